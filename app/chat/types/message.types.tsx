@@ -8,7 +8,6 @@ export const MessageType = {
   id: 'string',
   chat_room: 'string',
   sender: 'User',
-  sender_profile: 'UserProfile',
   message_type: 'MessageTypeEnum',
   content: 'string',
   file: 'string|null',
@@ -18,12 +18,13 @@ django_asgi_app = get_asgi_application()
 
 # Now import Django Channels and your app modules
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from campus_connect.middleware import JWTAuthMiddleware
 from campus_connect import routing
 
+# Websockets authenticate with the same JWT access tokens as the REST API
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
-    "websocket": AuthMiddlewareStack(
+    "websocket": JWTAuthMiddleware(
         URLRouter(
             routing.websocket_urlpatterns
         )
@@ -156,17 +156,73 @@ WSGI_APPLICATION = "backend_campus_connect.wsgi.application"
 
 ASGI_APPLICATION = 'backend_campus_connect.asgi.application'
 
-# Channel layers (Redis recommended for production)
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',  # Use InMemoryChannelLayer for development
-        # Uncomment the line below and configure Redis for production
-        # 'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        # 'CONFIG': {
-        #     "hosts": [('127.0.0.1', 6379)],
-        # },
-    },
-}
+# Channel layers. Set CHANNEL_REDIS_HOSTS to a comma separated list of redis
+# URLs to run chat on several ASGI workers/nodes: channels_redis puts every
+# group on one of the hosts by a plain crc32 of its name (no ring), so
+# adding hosts spreads the load (and moves most groups, dropping their
+# members until sockets reconnect; change the list in a quiet window).
+# Without it the in-process layer is used, which only works with one worker.
+# `manage.py benchmark_channel_layer` exercises whichever layer is configured.
+CHANNEL_REDIS_HOSTS = config('CHANNEL_REDIS_HOSTS', default='', cast=Csv())
+
+if CHANNEL_REDIS_HOSTS:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': CHANNEL_REDIS_HOSTS,
+                'prefix': config('CHANNEL_LAYER_PREFIX', default='campus'),
+                # Undelivered chat events are useless after a few seconds
+                'expiry': config('CHANNEL_LAYER_EXPIRY', default=10, cast=int),
+                # Sockets re-join their groups on reconnect, so memberships
+                # only need to outlive one connection
+                'group_expiry': config('CHANNEL_LAYER_GROUP_EXPIRY', default=6 * 60 * 60, cast=int),
+                # Per-channel queue length before sends fail with ChannelFull
+                'capacity': config('CHANNEL_LAYER_CAPACITY', default=500, cast=int),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+
+
+# Presence: a socket counts as gone PRESENCE_TTL seconds after its last
+# heartbeat. Every PRESENCE_FLUSH_INTERVAL each ASGI worker sweeps lapsed
+# sockets, reporting their users offline, and writes last_seen / is_online
+PRESENCE_TTL = config('PRESENCE_TTL', default=90, cast=int)
+PRESENCE_FLUSH_INTERVAL = config('PRESENCE_FLUSH_INTERVAL', default=30, cast=int)
+
+# Cache (Redis when REDIS_URL is set, per-process memory otherwise)
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# How long a websocket handshake may reuse a cached user row (seconds)
+WEBSOCKET_USER_CACHE_TTL = config('WEBSOCKET_USER_CACHE_TTL', default=60, cast=int)
+
+# How long marketplace / lost & found facet counts may be cached (seconds);
+# item writes retire them straight away
+FACET_CACHE_TTL = config('FACET_CACHE_TTL', default=600, cast=int)
 
 
 
@@ -317,6 +373,38 @@ CELERY_RESULT_BACKEND_MAX_RETRIES = 10
 CELERY_TASK_ACKS_LATE = True
 CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 
+# Without a Redis broker (local development) run tasks inline
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=not REDIS_URL, cast=bool)
+
+# Notifications fanned out to many users are written and pushed in batches of this size
+NOTIFICATION_FANOUT_BATCH_SIZE = config('NOTIFICATION_FANOUT_BATCH_SIZE', default=1000, cast=int)
+
+# Push delivery (point FCM_URL at `manage.py fcm_stub` to benchmark offline)
+FCM_SERVER_KEY = config('FCM_SERVER_KEY', default='')
+FCM_URL = config('FCM_URL', default='https://fcm.googleapis.com/fcm/send')
+PUSH_MAX_CONCURRENCY = config('PUSH_MAX_CONCURRENCY', default=20, cast=int)
+
+# Push outbox: retries back off exponentially from the base delay up to the
+# max, and rows are dead-lettered once they have used PUSH_MAX_ATTEMPTS
+PUSH_OUTBOX_BATCH_SIZE = config('PUSH_OUTBOX_BATCH_SIZE', default=500, cast=int)
+PUSH_MAX_ATTEMPTS = config('PUSH_MAX_ATTEMPTS', default=8, cast=int)
+PUSH_RETRY_BASE_DELAY = config('PUSH_RETRY_BASE_DELAY', default=30, cast=int)
+PUSH_RETRY_MAX_DELAY = config('PUSH_RETRY_MAX_DELAY', default=3600, cast=int)
+PUSH_OUTBOX_LEASE = config('PUSH_OUTBOX_LEASE', default=300, cast=int)
+# Minimum seconds between pushes for the same conversation
+PUSH_COLLAPSE_INTERVAL = config('PUSH_COLLAPSE_INTERVAL', default=30, cast=int)
+
+CELERY_BEAT_SCHEDULE = {
+    'drain-push-outbox': {
+        'task': 'notifications.tasks.drain_push_outbox',
+        'schedule': 15.0,
+    },
+    'reconcile-notification-counters': {
+        'task': 'notifications.tasks.reconcile_notification_counters',
+        'schedule': 60 * 60.0,
+    },
+}
+
 
 
 
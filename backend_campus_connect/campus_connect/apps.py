@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CampusConnectConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "campus_connect"
+
+    def ready(self):
+        import campus_connect.signals
@@ -1,55 +1,65 @@
 
 
 # consumers.py
+import asyncio
 import json
+import uuid
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.db.models import Q
-from .models import ChatRoom, Message
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import ChatRoom
+from .presence import (
+    presence, presence_connect, presence_disconnect, presence_heartbeat, user_group_name
+)
 from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import AccessToken
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from urllib.parse import parse_qs
 import logging
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    # Re-join groups this often so memberships never hit the layer's group_expiry
+    group_refresh_interval = 60 * 60
+    # Typing: peers are told at most every typing_repeat_interval seconds
+    # while typing continues, and "typing" lapses after typing_timeout
+    # seconds without a new typing frame
+    typing_repeat_interval = 3
+    typing_timeout = 5
+    # Most message ids a single receipt frame may carry
+    max_receipt_ids = 500
+
     async def connect(self):
+        self.presence_registered = False
+        self.is_typing = False
+        self.typing_sent_at = 0
+        self.typing_deadline = 0
+        self.typing_expiry = None
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'chat_{self.room_id}'
         
-        # Get token from query string
-        query_string = self.scope.get('query_string', b'').decode()
-        query_params = parse_qs(query_string)
-        token = query_params.get('token', [None])[0]
-        
-        if not token:
-            logger.warning("No token provided in WebSocket connection")
-            await self.close()
-            return
-        
-        # Authenticate user with JWT token
-        self.user = await self.get_user_from_jwt_token(token)
+        # Resolved from the ?token= JWT by JWTAuthMiddleware
+        self.user = self.scope.get('user')
         
-        if not self.user:
-            logger.warning(f"Invalid token provided: {token[:20]}...")
+        if not self.user or not self.user.is_authenticated:
+            logger.warning("Missing or invalid token in WebSocket connection")
+            self.user = None
             await self.close()
             return
         
-        # Verify user has access to this chat room
+        # Verify user has access to this chat room; the room and its
+        # participants are kept for the lifetime of the socket
+        self.chat_room = None
         has_access = await self.verify_chat_room_access()
         if not has_access:
             logger.warning(f"User {self.user.username} doesn't have access to room {self.room_id}")
             await self.close()
             return
         
-        # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        # Join room group, and the user's own group for presence events
+        await self.join_groups()
         
         await self.accept()
         logger.info(f"WebSocket connected for user {self.user.username} in room {self.room_id}")
@@ -65,29 +75,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
         
+        if getattr(self, 'is_typing', False):
+            await self.set_typing(False)
+        
         # Update user's online status
-        if hasattr(self, 'user') and self.user:
+        if getattr(self, 'presence_registered', False):
+            await self.channel_layer.group_discard(
+                user_group_name(self.user.id),
+                self.channel_name
+            )
             await self.update_user_status(False)
         
+        self.invalidate_chat_room()
         logger.info(f"WebSocket disconnected with code {close_code}")
     
-    @database_sync_to_async
-    def get_user_from_jwt_token(self, token):
-        try:
-            # Validate JWT token
-            access_token = AccessToken(token)
-            user_id = access_token['user_id']
-            
-            # Get user from database
-            user = User.objects.get(id=user_id)
-            return user
-        except (InvalidToken, TokenError, User.DoesNotExist) as e:
-            logger.error(f"JWT token validation failed: {str(e)}")
-            return None
-        except Exception as e:
-            logger.error(f"Unexpected error during JWT validation: {str(e)}")
-            return None
-    
     async def receive(self, text_data):
         try:
             data = json.loads(text_data)
@@ -96,6 +97,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if message_type == 'chat_message':
                 content = data.get('content', '').strip()
                 if content:
+                    # Sending the message ends the typing spell
+                    await self.set_typing(False)
                     # Save message to database
                     message = await self.save_message(content)
                     if message:
@@ -115,24 +118,33 @@ class ChatConsumer(AsyncWebsocketConsumer):
                         )
             
             elif message_type == 'typing':
-                # Handle typing indicators
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'typing_indicator',
-                        'user': self.user.username,
-                        'is_typing': data.get('is_typing', False)
-                    }
-                )
+                # Handle typing indicators; repeats are absorbed here
+                await self.set_typing(bool(data.get('is_typing', False)))
+            
+            elif message_type == 'heartbeat':
+                # Sent periodically by clients to stay online
+                if await presence_heartbeat(self.user.id, self.channel_name):
+                    await presence.broadcast(self.channel_layer, self.user.id, True)
+                if time.monotonic() - self.groups_joined_at > self.group_refresh_interval:
+                    await self.join_groups()
             
             elif message_type == 'mark_read':
                 # Mark messages as read
-                await self.mark_messages_read()
+                await self.handle_receipt('read')
+            
+            elif message_type == 'receipt':
+                # {"status": "delivered"|"read", "message_ids": [...]} or {"status": ..., "up_to": <ISO time>}
+                await self.handle_receipt(
+                    data.get('status'),
+                    message_ids=data.get('message_ids'),
+                    up_to=data.get('up_to')
+                )
                 
+            # Single-message frames from older clients
             elif message_type == 'message_delivered':
-                await self.update_message_status(data.get('message_id'), 'delivered')
+                await self.handle_receipt('delivered', message_ids=[data.get('message_id')])
             elif message_type == 'message_read':
-                await self.update_message_status(data.get('message_id'), 'read')
+                await self.handle_receipt('read', message_ids=[data.get('message_id')])
         
         except json.JSONDecodeError:
             await self.send(text_data=json.dumps({
@@ -162,35 +174,164 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'is_typing': event['is_typing']
             }))
     
+    async def message_receipt(self, event):
+        """Aggregated delivery/read receipt, relayed to the other participant"""
+        if event['reader_id'] != self.user.id:
+            await self.send(text_data=json.dumps({
+                'type': 'message_receipt',
+                'reader_id': event['reader_id'],
+                'status': event['status'],
+                'message_ids': event['message_ids'],
+                'up_to': event['up_to'],
+                'at': event['at']
+            }))
+    
+    async def user_presence(self, event):
+        """One of the user's connections came online or went offline"""
+        await self.send(text_data=json.dumps({
+            'type': 'user_presence',
+            'user_id': event['user_id'],
+            'is_online': event['is_online'],
+            'last_seen': event['last_seen']
+        }))
+    
+    async def chat_room_revoked(self, event):
+        """The participants are no longer connected; drop the cached room and hang up"""
+        self.invalidate_chat_room()
+        await self.close()
+    
+    async def handle_receipt(self, status, message_ids=None, up_to=None):
+        """
+        Apply a delivery/read receipt for a batch of messages with one UPDATE
+        and tell the sender with one event, however many messages it covers.
+        """
+        if status not in ChatRoom.RECEIPT_STATUSES:
+            await self.send(text_data=json.dumps({'error': 'Invalid receipt status'}))
+            return
+        if message_ids is not None:
+            if not isinstance(message_ids, list) or len(message_ids) > self.max_receipt_ids:
+                await self.send(text_data=json.dumps({'error': 'Invalid message_ids'}))
+                return
+            message_ids = [str(message_id) for message_id in message_ids if message_id]
+            try:
+                for message_id in message_ids:
+                    uuid.UUID(message_id)
+            except ValueError:
+                await self.send(text_data=json.dumps({'error': 'Invalid message_ids'}))
+                return
+            if not message_ids:
+                return
+            if status == 'read':
+                # Reading some messages reads everything received before
+                # them, so the sender hears about the cursor, not the ids
+                up_to = await self.read_watermark(message_ids)
+                if up_to is None:
+                    return
+                message_ids = None
+        elif up_to is not None:
+            watermark = parse_datetime(str(up_to))
+            if watermark is None:
+                await self.send(text_data=json.dumps({'error': 'Invalid up_to timestamp'}))
+                return
+            if timezone.is_naive(watermark):
+                watermark = timezone.make_aware(watermark)
+            up_to = watermark
+        else:
+            # Everything received so far
+            up_to = timezone.now()
+        
+        updated = await self.apply_receipt(status, message_ids, up_to)
+        if not updated:
+            return
+        
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'message_receipt',
+                'reader_id': self.user.id,
+                'status': status,
+                'message_ids': message_ids,
+                'up_to': up_to.isoformat() if message_ids is None else None,
+                'at': timezone.now().isoformat()
+            }
+        )
+    
+    async def set_typing(self, is_typing):
+        """
+        Per-socket typing state machine. Only idle <-> typing transitions
+        reach the channel layer, plus a rate-limited repeat while typing
+        continues so peers' indicators stay fresh; keystroke-rate frames
+        in between are dropped.
+        """
+        now = time.monotonic()
+        if is_typing:
+            self.typing_deadline = now + self.typing_timeout
+            if self.is_typing and now - self.typing_sent_at < self.typing_repeat_interval:
+                return
+            if self.typing_expiry is None or self.typing_expiry.done():
+                self.typing_expiry = asyncio.ensure_future(self.expire_typing())
+        elif not self.is_typing:
+            return
+        elif self.typing_expiry is not None and self.typing_expiry is not asyncio.current_task():
+            self.typing_expiry.cancel()
+        
+        self.is_typing = is_typing
+        self.typing_sent_at = now
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'typing_indicator',
+                'user': self.user.username,
+                'is_typing': is_typing
+            }
+        )
+    
+    async def expire_typing(self):
+        """Stop typing once no typing frame has arrived for typing_timeout"""
+        while True:
+            delay = self.typing_deadline - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        await self.set_typing(False)
+    
+    async def join_groups(self):
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.channel_layer.group_add(user_group_name(self.user.id), self.channel_name)
+        self.groups_joined_at = time.monotonic()
+    
+    def invalidate_chat_room(self):
+        """Forget the access decision cached at connect"""
+        self.chat_room = None
+        self.participant_ids = frozenset()
+    
     @database_sync_to_async
     def verify_chat_room_access(self):
+        # Runs once per socket; later writes reuse self.chat_room instead of
+        # repeating this authorization query
         try:
-            chat_room = ChatRoom.objects.get(
+            self.chat_room = ChatRoom.objects.select_related('user1', 'user2').get(
                 Q(user1=self.user) | Q(user2=self.user),
                 id=self.room_id
             )
-            return True
         except ChatRoom.DoesNotExist:
+            self.invalidate_chat_room()
             return False
+        self.participant_ids = frozenset((self.chat_room.user1_id, self.chat_room.user2_id))
+        return True
     
     @database_sync_to_async
     def save_message(self, content):
+        if self.chat_room is None:
+            return None
         try:
-            chat_room = ChatRoom.objects.get(
-                Q(user1=self.user) | Q(user2=self.user),
-                id=self.room_id
-            )
-            
-            message = Message.objects.create(
-                chat_room=chat_room,
-                sender=self.user,
+            # Inserts the message and updates the room's inbox state in one transaction
+            message = self.chat_room.add_message(
+                self.user,
                 content=content,
                 message_type='text'
             )
             
-            # Update chat room timestamp
-            chat_room.save()
-            
             return {
                 'id': message.id,
                 'content': message.content,
@@ -206,38 +347,36 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return None
     
     @database_sync_to_async
-    def mark_messages_read(self):
-        try:
-            chat_room = ChatRoom.objects.get(
-                Q(user1=self.user) | Q(user2=self.user),
-                id=self.room_id
-            )
-            
-            Message.objects.filter(
-                chat_room=chat_room,
-                is_read=False
-            ).exclude(sender=self.user).update(is_read=True)
-            
-        except Exception as e:
-            logger.error(f"Error marking messages as read: {str(e)}")
+    def read_watermark(self, message_ids):
+        if self.chat_room is None:
+            return None
+        return self.chat_room.read_watermark(self.user, message_ids)
     
     @database_sync_to_async
-    def update_message_status(self, message_id, status):
+    def apply_receipt(self, status, message_ids, up_to):
+        if self.chat_room is None:
+            return 0
         try:
-            message = Message.objects.get(id=message_id)
-            if status == 'delivered':
-                message.is_delivered = True
-            elif status == 'read':
-                message.is_read = True
-            message.save()
+            return self.chat_room.apply_receipt(self.user, status, message_ids=message_ids, up_to=up_to)
         except Exception as e:
-            logger.error(f"Error updating message status: {str(e)}")
+            logger.error(f"Error applying receipt: {str(e)}")
+            return 0
     
-    @database_sync_to_async
-    def update_user_status(self, is_online):
-        # You can implement user online status tracking here
-        # For now, we'll skip this implementation
-        pass
+    async def update_user_status(self, is_online):
+        """
+        Count this socket in or out of the user's presence and tell their
+        connections when the user as a whole goes online or offline. The
+        database columns are written later by the tracker's periodic sweep.
+        """
+        presence.ensure_sweeper(self.channel_layer)
+        if is_online:
+            changed = await presence_connect(self.user.id, self.channel_name)
+            self.presence_registered = True
+        else:
+            changed = await presence_disconnect(self.user.id, self.channel_name)
+            self.presence_registered = False
+        if changed:
+            await presence.broadcast(self.channel_layer, self.user.id, is_online)
 
 
 
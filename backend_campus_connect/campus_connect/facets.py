@@ -0,0 +1,106 @@
+"""
+Filter chip counts for marketplace and lost & found browsing.
+
+Each set of facets is one grouped query, cached under a key versioned by
+a generation counter. Saving or deleting an item bumps the counter (see
+the signals in campus_connect/signals.py, which also cover
+mark_item_as_sold since it saves the item), so readers move to a fresh
+key and a count computed before the write can never be stored under it.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import LostAndFoundItem, MarketplaceItem
+
+MARKETPLACE_FACETS_KEY = 'facets:marketplace'
+LOST_FOUND_FACETS_KEY = 'facets:lost_found'
+
+# (min, max) price bounds, max exclusive; None means unbounded
+PRICE_BUCKETS = [(0, 10), (10, 50), (50, 100), (100, 500), (500, None)]
+
+
+def price_bucket_filter(low, high):
+    bounds = Q(price__gte=low)
+    if high is not None:
+        bounds &= Q(price__lt=high)
+    return bounds
+
+
+def compute_marketplace_facets():
+    """Unsold item counts per category and per price bucket"""
+    buckets = {
+        f'bucket_{index}': Count('id', filter=price_bucket_filter(low, high))
+        for index, (low, high) in enumerate(PRICE_BUCKETS)
+    }
+    rows = (
+        MarketplaceItem.objects.filter(is_sold=False)
+        .order_by()
+        .values('category')
+        .annotate(total=Count('id'), **buckets)
+    )
+
+    categories = dict.fromkeys((value for value, _label in MarketplaceItem.CATEGORY_CHOICES), 0)
+    bucket_counts = [0] * len(PRICE_BUCKETS)
+    for row in rows:
+        categories[row['category']] = row['total']
+        for index in range(len(PRICE_BUCKETS)):
+            bucket_counts[index] += row[f'bucket_{index}']
+
+    return {
+        'total': sum(categories.values()),
+        'categories': categories,
+        'price_buckets': [
+            {'min': low, 'max': high, 'count': count}
+            for (low, high), count in zip(PRICE_BUCKETS, bucket_counts)
+        ],
+    }
+
+
+def compute_lost_found_facets():
+    """Lost & found report counts per status"""
+    statuses = dict.fromkeys((value for value, _label in LostAndFoundItem.STATUS_CHOICES), 0)
+    statuses.update(
+        LostAndFoundItem.objects.order_by().values_list('status').annotate(total=Count('id'))
+    )
+    return {'total': sum(statuses.values()), 'statuses': statuses}
+
+
+def generation_key(key):
+    return f'{key}:generation'
+
+
+def new_generation():
+    # Clock based, so a counter lost to eviction restarts past every
+    # generation handed out before instead of reusing an old key
+    return time.time_ns()
+
+
+def facets_generation(key):
+    generation = cache.get(generation_key(key))
+    if generation is None:
+        cache.add(generation_key(key), new_generation(), None)
+        generation = cache.get(generation_key(key))
+    return generation
+
+
+def bump_facets_generation(key):
+    """Make readers of `key` recompute; run after the write has committed"""
+    try:
+        cache.incr(generation_key(key))
+    except ValueError:
+        cache.add(generation_key(key), new_generation(), None)
+
+
+def cached_facets(key, compute):
+    return cache.get_or_set(f'{key}:{facets_generation(key)}', compute, settings.FACET_CACHE_TTL)
+
+
+def marketplace_facets():
+    return cached_facets(MARKETPLACE_FACETS_KEY, compute_marketplace_facets)
+
+
+def lost_found_facets():
+    return cached_facets(LOST_FOUND_FACETS_KEY, compute_lost_found_facets)
@@ -0,0 +1,141 @@
+import asyncio
+import statistics
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Fan chat-style group messages across several channel layer instances "
+        "(one per simulated ASGI worker) and check every member receives them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hosts', help='Comma separated redis URLs (defaults to CHANNEL_REDIS_HOSTS)')
+        parser.add_argument('--fake', action='store_true',
+                            help='Shard over in-process fakeredis servers instead of real redis')
+        parser.add_argument('--shards', type=int, default=2, help='Fake redis hosts for --fake')
+        parser.add_argument('--nodes', type=int, default=2, help='Simulated ASGI workers')
+        parser.add_argument('--groups', type=int, default=50, help='Chat rooms')
+        parser.add_argument('--members', type=int, default=2, help='Sockets per room')
+        parser.add_argument('--messages', type=int, default=20, help='Messages sent to each room')
+
+    def handle(self, *args, **options):
+        if options['nodes'] < 1 or options['members'] < 1:
+            raise CommandError('--nodes and --members must be at least 1')
+
+        if options['fake']:
+            hosts = self.fake_hosts(options['shards'])
+            description = f"fakeredis across {len(hosts)} host(s), {options['nodes']} worker(s)"
+        else:
+            hosts = options['hosts'].split(',') if options['hosts'] else settings.CHANNEL_REDIS_HOSTS
+            if not hosts:
+                raise CommandError('No redis hosts: pass --hosts, set CHANNEL_REDIS_HOSTS or use --fake')
+            description = f"redis across {len(hosts)} host(s), {options['nodes']} worker(s)"
+
+        self.stdout.write(f"Channel layer: {description}")
+        asyncio.run(self.run(self.build_redis_layers(hosts, options), options))
+
+    def fake_hosts(self, shards):
+        """One in-process fakeredis server per host, so groups really shard"""
+        if shards < 1:
+            raise CommandError('--shards must be at least 1')
+        try:
+            from fakeredis import FakeServer
+            from fakeredis.aioredis import FakeConnection
+        except ImportError:
+            raise CommandError('fakeredis is not installed')
+        return [{'connection_class': FakeConnection, 'server': FakeServer()} for _ in range(shards)]
+
+    def build_redis_layers(self, hosts, options):
+        try:
+            from channels_redis.core import RedisChannelLayer
+        except ImportError:
+            raise CommandError('channels_redis is not installed')
+
+        config = dict(settings.CHANNEL_LAYERS['default'].get('CONFIG', {}))
+        config.update(
+            hosts=hosts,
+            # Keep benchmark keys apart from live traffic so they can be flushed
+            prefix=f"bench-{uuid.uuid4().hex[:8]}",
+            capacity=max(config.get('capacity', 100), options['messages'] + 1),
+        )
+        return [RedisChannelLayer(**config) for _ in range(options['nodes'])]
+
+    async def run(self, layers, options):
+        nodes = len(layers)
+        group_count = options['groups']
+        per_group = options['messages']
+
+        # Each room's sockets are spread over different workers, as they
+        # would be behind a load balancer
+        members = []
+        for group_index in range(group_count):
+            group = f"chat_bench_{group_index}"
+            for member_index in range(options['members']):
+                layer = layers[(group_index + member_index) % nodes]
+                channel = await layer.new_channel()
+                await layer.group_add(group, channel)
+                members.append((group, layer, channel))
+
+        shards = getattr(layers[0], 'ring_size', 1)
+        if shards > 1:
+            spread = Counter(
+                layers[0].consistent_hash(f"chat_bench_{index}") for index in range(group_count)
+            )
+            self.stdout.write(
+                "Groups per redis host: " + ", ".join(f"{index}: {spread[index]}" for index in range(shards))
+            )
+
+        latencies = []
+
+        async def consume(layer, channel):
+            last_seq = -1
+            for _ in range(per_group):
+                message = await layer.receive(channel)
+                latencies.append(time.perf_counter() - message['sent'])
+                if message['seq'] <= last_seq:
+                    raise CommandError(f'Out of order delivery on {channel}')
+                last_seq = message['seq']
+            return last_seq + 1
+
+        async def produce(group_index):
+            # Send from a worker that does not host the room's first socket
+            layer = layers[(group_index + 1) % nodes]
+            for seq in range(per_group):
+                await layer.group_send(
+                    f"chat_bench_{group_index}",
+                    {'type': 'chat.message', 'seq': seq, 'sent': time.perf_counter()},
+                )
+
+        started = time.perf_counter()
+        consumers = [
+            asyncio.create_task(consume(layer, channel)) for _group, layer, channel in members
+        ]
+        await asyncio.gather(*(produce(index) for index in range(group_count)))
+        try:
+            received = await asyncio.wait_for(asyncio.gather(*consumers), timeout=60)
+        except asyncio.TimeoutError:
+            raise CommandError('Timed out waiting for deliveries; messages were lost')
+        elapsed = time.perf_counter() - started
+
+        for group, layer, channel in members:
+            await layer.group_discard(group, channel)
+        for layer in layers:
+            await layer.flush()
+
+        delivered = sum(received)
+        expected = len(members) * per_group
+        latencies.sort()
+        self.stdout.write(
+            f"{delivered}/{expected} deliveries in {elapsed:.2f}s ({delivered / elapsed:.0f} msg/s), "
+            f"latency p50 {statistics.median(latencies) * 1000:.1f}ms "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms"
+        )
+        if delivered != expected:
+            raise CommandError('Some deliveries were lost')
+        self.stdout.write(self.style.SUCCESS('All group messages delivered in order'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from campus_connect.models import SearchDocument
+from campus_connect.search import DOCUMENT_SOURCES
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the campus search documents from posts, marketplace items, "
+        "lost & found reports, clubs and events (e.g. after bulk updates that "
+        "bypassed the save signals)"
+    )
+
+    def handle(self, *args, **options):
+        total = 0
+        with transaction.atomic():
+            SearchDocument.objects.all().delete()
+            for model, (doc_type, build) in DOCUMENT_SOURCES.items():
+                documents = [
+                    SearchDocument(doc_type=doc_type, object_id=instance.pk, **build(instance))
+                    for instance in model.objects.iterator(chunk_size=1000)
+                ]
+                SearchDocument.objects.bulk_create(documents, batch_size=1000)
+                total += len(documents)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} search documents'))
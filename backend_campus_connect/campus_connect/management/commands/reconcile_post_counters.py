@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from campus_connect.models import Post, PostLike, Comment
+
+
+def count_subquery(model):
+    """Correlated COUNT(*) of `model` rows pointing at the outer Post"""
+    counts = (
+        model.objects.filter(post=OuterRef('pk'))
+        .order_by()
+        .values('post')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = "Recompute Post.likes_count and Post.comments_count from the source tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--post', type=int, action='append', dest='post_ids',
+            help='Only reconcile the given post id (may be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.all()
+        if options['post_ids']:
+            posts = posts.filter(pk__in=options['post_ids'])
+
+        # One UPDATE ... SET col = (SELECT COUNT(*) ...) for the whole table
+        updated = posts.update(
+            likes_count=count_subquery(PostLike),
+            comments_count=count_subquery(Comment),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Reconciled counters on {updated} posts'))
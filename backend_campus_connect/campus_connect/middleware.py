@@ -0,0 +1,80 @@
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+import logging
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+
+def websocket_user_cache_key(user_id):
+    return f"ws_user:{user_id}"
+
+
+# What consumers read from scope['user']; the cache never holds the rest
+# of the row (password hash included)
+WEBSOCKET_USER_FIELDS = ('id', 'username', 'first_name', 'last_name', 'is_active')
+
+
+@database_sync_to_async
+def load_active_user_fields(user_id):
+    return User.objects.filter(pk=user_id, is_active=True).values(*WEBSOCKET_USER_FIELDS).first()
+
+
+def build_user(values):
+    """
+    A User loaded with the cached fields only. Other fields are
+    deferred: reading one fetches it, and save() writes the loaded ones.
+    """
+    return User.from_db('default', list(values), list(values.values()))
+
+
+async def get_user_for_token(raw_token):
+    """
+    Validate a JWT access token and resolve its user.
+
+    Signature and expiry checks are pure CPU work. The fields consumers
+    need are cached by user id for WEBSOCKET_USER_CACHE_TTL seconds, so a
+    burst of reconnects from the same account (e.g. after a deploy) costs
+    a single DB lookup.
+    """
+    try:
+        token = AccessToken(raw_token)
+    except TokenError as e:
+        logger.warning(f"JWT token validation failed: {str(e)}")
+        return AnonymousUser()
+
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    if user_id is None:
+        return AnonymousUser()
+
+    key = websocket_user_cache_key(user_id)
+    values = await cache.aget(key)
+    if values is None:
+        values = await load_active_user_fields(user_id)
+        if values is None:
+            return AnonymousUser()
+        await cache.aset(key, values, settings.WEBSOCKET_USER_CACHE_TTL)
+    return build_user(values)
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Populate scope['user'] from the `?token=<access token>` query parameter
+    of a websocket handshake. Connections without a valid token get an
+    AnonymousUser and are left for the consumer to reject.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        query_params = parse_qs(scope.get('query_string', b'').decode())
+        token = query_params.get('token', [None])[0]
+        scope['user'] = await get_user_for_token(token) if token else AnonymousUser()
+        return await super().__call__(scope, receive, send)
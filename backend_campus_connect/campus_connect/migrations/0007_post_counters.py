@@ -0,0 +1,47 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:57
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_post_counters(apps, schema_editor):
+    Post = apps.get_model("campus_connect", "Post")
+    PostLike = apps.get_model("campus_connect", "PostLike")
+    Comment = apps.get_model("campus_connect", "Comment")
+
+    def count_subquery(model):
+        counts = (
+            model.objects.filter(post=OuterRef("pk"))
+            .order_by()
+            .values("post")
+            .annotate(total=Count("pk"))
+            .values("total")
+        )
+        return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+    Post.objects.update(
+        likes_count=count_subquery(PostLike),
+        comments_count=count_subquery(Comment),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("campus_connect", "0006_alter_post_category"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="comments_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="likes_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_post_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Left
+
+
+def backfill_inbox_state(apps, schema_editor):
+    ChatRoom = apps.get_model("campus_connect", "ChatRoom")
+    Message = apps.get_model("campus_connect", "Message")
+
+    latest = Message.objects.filter(chat_room=OuterRef("pk")).order_by(
+        "-created_at", "-id"
+    )
+
+    def unread_for(participant):
+        counts = (
+            Message.objects.filter(chat_room=OuterRef("pk"), is_read=False)
+            .exclude(sender=OuterRef(participant))
+            .order_by()
+            .values("chat_room")
+            .annotate(total=Count("pk"))
+            .values("total")
+        )
+        return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+    ChatRoom.objects.update(
+        last_message=Subquery(latest.values("id")[:1]),
+        last_message_preview=Coalesce(
+            Left(Subquery(latest.values("content")[:1]), 100), Value("")
+        ),
+        user1_unread_count=unread_for("user1"),
+        user2_unread_count=unread_for("user2"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("campus_connect", "0007_post_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatroom",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="campus_connect.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="last_message_preview",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="user1_unread_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="user2_unread_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_inbox_state, migrations.RunPython.noop),
+    ]
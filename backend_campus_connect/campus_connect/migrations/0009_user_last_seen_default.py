@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:13
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("campus_connect", "0008_chatroom_inbox_state"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="user",
+            name="last_seen",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_read_cursors(apps, schema_editor):
+    """Start each participant's cursor at the newest message they had read"""
+    ChatRoom = apps.get_model("campus_connect", "ChatRoom")
+    Message = apps.get_model("campus_connect", "Message")
+
+    for participant in ("user1", "user2"):
+        last_read = (
+            Message.objects.filter(chat_room=OuterRef("pk"), is_read=True)
+            .exclude(sender=OuterRef(participant))
+            .order_by("-created_at", "-id")
+        )
+        ChatRoom.objects.update(
+            **{
+                f"{participant}_last_read_at": Subquery(
+                    last_read.values("created_at")[:1]
+                ),
+                f"{participant}_last_read_message": Subquery(
+                    last_read.values("id")[:1]
+                ),
+            }
+        )
+
+        # Unread now means received after the cursor; rooms without one
+        # keep their existing counters
+        unread = (
+            Message.objects.filter(
+                chat_room=OuterRef("pk"),
+                is_read=False,
+                created_at__gt=OuterRef(f"{participant}_last_read_at"),
+            )
+            .exclude(sender=OuterRef(participant))
+            .order_by()
+            .values("chat_room")
+            .annotate(total=Count("pk"))
+            .values("total")
+        )
+        ChatRoom.objects.filter(
+            **{f"{participant}_last_read_at__isnull": False}
+        ).update(
+            **{
+                f"{participant}_unread_count": Coalesce(
+                    Subquery(unread, output_field=IntegerField()), Value(0)
+                )
+            }
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("campus_connect", "0009_user_last_seen_default"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="message",
+            name="campus_conn_is_read_aef591_idx",
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="user1_last_read_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="user1_last_read_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="campus_connect.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="user2_last_read_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="user2_last_read_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="campus_connect.message",
+            ),
+        ),
+        migrations.RunPython(backfill_read_cursors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+from django.db import migrations
+
+FTS_TABLE = "campus_connect_message_fts"
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            "ALTER TABLE campus_connect_message ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED"
+        )
+        schema_editor.execute(
+            "CREATE INDEX campus_connect_message_search_idx "
+            "ON campus_connect_message USING GIN (search_vector)"
+        )
+    elif vendor == "sqlite":
+        statements = [
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "content, content='campus_connect_message', tokenize='porter unicode61')",
+            f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON campus_connect_message BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.rowid, new.content); END",
+            f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON campus_connect_message BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) "
+            "VALUES ('delete', old.rowid, old.content); END",
+            f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF content ON campus_connect_message BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) "
+            "VALUES ('delete', old.rowid, old.content); "
+            f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.rowid, new.content); END",
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+        ]
+        for statement in statements:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            "ALTER TABLE campus_connect_message DROP COLUMN IF EXISTS search_vector"
+        )
+    elif vendor == "sqlite":
+        for suffix in ("ai", "ad", "au"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("campus_connect", "0010_chatroom_read_cursors"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
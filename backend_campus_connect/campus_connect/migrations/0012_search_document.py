@@ -0,0 +1,182 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+TABLE = "campus_connect_searchdocument"
+FTS_TABLE = "campus_connect_searchdocument_fts"
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        # Title matches rank above body matches
+        schema_editor.execute(
+            f"ALTER TABLE {TABLE} ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(body, '')), 'B')) STORED"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX campus_connect_searchdocument_search_idx "
+            f"ON {TABLE} USING GIN (search_vector)"
+        )
+    elif vendor == "sqlite":
+        delete = (
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body) "
+            "VALUES ('delete', old.rowid, old.title, old.body);"
+        )
+        insert = (
+            f"INSERT INTO {FTS_TABLE}(rowid, title, body) "
+            "VALUES (new.rowid, new.title, new.body);"
+        )
+        statements = [
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"title, body, content='{TABLE}', tokenize='porter unicode61')",
+            f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {TABLE} BEGIN {insert} END",
+            f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {TABLE} BEGIN {delete} END",
+            f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF title, body ON {TABLE} "
+            f"BEGIN {delete} {insert} END",
+        ]
+        for statement in statements:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS search_vector"
+        )
+    elif vendor == "sqlite":
+        for suffix in ("ai", "ad", "au"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def join_text(*parts):
+    return "\n".join(part for part in parts if part)
+
+
+def backfill_search_documents(apps, schema_editor):
+    """Index the existing posts, items, clubs and events"""
+    SearchDocument = apps.get_model("campus_connect", "SearchDocument")
+    sources = [
+        (
+            "post",
+            apps.get_model("campus_connect", "Post"),
+            lambda post: dict(
+                title=post.title,
+                body=post.content,
+                category=post.category,
+                created_at=post.created_at,
+            ),
+        ),
+        (
+            "marketplace",
+            apps.get_model("campus_connect", "MarketplaceItem"),
+            lambda item: dict(
+                title=item.title,
+                body=item.description,
+                category=item.category,
+                is_active=not item.is_sold,
+                created_at=item.created_at,
+            ),
+        ),
+        (
+            "lost_found",
+            apps.get_model("campus_connect", "LostAndFoundItem"),
+            lambda item: dict(
+                title=item.title,
+                body=join_text(item.description, item.location),
+                category=item.status,
+                created_at=item.created_at,
+            ),
+        ),
+        (
+            "club",
+            apps.get_model("campus_connect", "Club"),
+            lambda club: dict(
+                title=club.name, body=club.description, category=club.category
+            ),
+        ),
+        (
+            "event",
+            apps.get_model("campus_connect", "Event"),
+            lambda event: dict(
+                title=event.title,
+                body=join_text(event.description, event.location),
+                category=event.category,
+                created_at=event.start_time,
+            ),
+        ),
+    ]
+    for doc_type, model, build in sources:
+        SearchDocument.objects.bulk_create(
+            (
+                SearchDocument(
+                    doc_type=doc_type, object_id=instance.pk, **build(instance)
+                )
+                for instance in model.objects.iterator(chunk_size=1000)
+            ),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("campus_connect", "0011_message_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchDocument",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "doc_type",
+                    models.CharField(
+                        choices=[
+                            ("post", "Post"),
+                            ("marketplace", "Marketplace Item"),
+                            ("lost_found", "Lost & Found Item"),
+                            ("club", "Club"),
+                            ("event", "Event"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("object_id", models.PositiveBigIntegerField()),
+                ("title", models.CharField(max_length=255)),
+                ("body", models.TextField(blank=True)),
+                ("category", models.CharField(blank=True, max_length=50)),
+                ("is_active", models.BooleanField(default=True)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["doc_type", "category"],
+                        name="campus_conn_doc_typ_d8e6ee_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("doc_type", "object_id"), name="unique_search_document"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("campus_connect", "0012_search_document"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="marketplaceitem",
+            index=models.Index(
+                condition=models.Q(("is_sold", False)),
+                fields=["-created_at", "-id"],
+                name="marketplace_recent_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="marketplaceitem",
+            index=models.Index(
+                condition=models.Q(("is_sold", False)),
+                fields=["category", "-created_at", "-id"],
+                name="marketplace_cat_recent_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="marketplaceitem",
+            index=models.Index(
+                condition=models.Q(("is_sold", False)),
+                fields=["price", "id"],
+                name="marketplace_price_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="marketplaceitem",
+            index=models.Index(
+                condition=models.Q(("is_sold", False)),
+                fields=["category", "price", "id"],
+                name="marketplace_cat_price_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,87 @@
+from django.db import migrations
+
+# (table, indexed columns) of each SQLite FTS5 index
+INDEXES = [
+    ("campus_connect_message", ("content",)),
+    ("campus_connect_searchdocument", ("title", "body")),
+]
+
+
+def drop_fts(schema_editor, table):
+    fts_table = f"{table}_fts"
+    for suffix in ("ai", "ad", "au"):
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {fts_table}")
+
+
+def keyed_statements(table, columns):
+    """FTS5 table with its own copy of the text, keyed on the primary key"""
+    fts_table = f"{table}_fts"
+    names = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    delete = f"DELETE FROM {fts_table} WHERE id = old.id;"
+    insert = f"INSERT INTO {fts_table}({names}, id) VALUES ({new_values}, new.id);"
+    return [
+        f"CREATE VIRTUAL TABLE {fts_table} USING fts5("
+        f"{names}, id UNINDEXED, tokenize='porter unicode61')",
+        f"CREATE TRIGGER {fts_table}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER {fts_table}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER {fts_table}_au AFTER UPDATE OF {names} ON {table} "
+        f"BEGIN {delete} {insert} END",
+        f"INSERT INTO {fts_table}({names}, id) SELECT {names}, id FROM {table}",
+    ]
+
+
+def rowid_statements(table, columns):
+    """The external-content FTS5 table of 0011/0012, keyed on the rowid"""
+    fts_table = f"{table}_fts"
+    names = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+    delete = (
+        f"INSERT INTO {fts_table}({fts_table}, rowid, {names}) "
+        f"VALUES ('delete', old.rowid, {old_values});"
+    )
+    insert = (
+        f"INSERT INTO {fts_table}(rowid, {names}) VALUES (new.rowid, {new_values});"
+    )
+    return [
+        f"CREATE VIRTUAL TABLE {fts_table} USING fts5("
+        f"{names}, content='{table}', tokenize='porter unicode61')",
+        f"CREATE TRIGGER {fts_table}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER {fts_table}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER {fts_table}_au AFTER UPDATE OF {names} ON {table} "
+        f"BEGIN {delete} {insert} END",
+        f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')",
+    ]
+
+
+def rebuild_indexes(statements):
+    def rebuild(apps, schema_editor):
+        # PostgreSQL's generated columns have no rowid to depend on
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for table, columns in INDEXES:
+            drop_fts(schema_editor, table)
+            for statement in statements(table, columns):
+                schema_editor.execute(statement)
+
+    return rebuild
+
+
+class Migration(migrations.Migration):
+    """
+    Key the SQLite full-text indexes on the primary key instead of the
+    rowid, which VACUUM may renumber on tables without an integer key
+    (messages have UUID keys).
+    """
+
+    dependencies = [
+        ("campus_connect", "0013_marketplace_browse_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            rebuild_indexes(keyed_statements), rebuild_indexes(rowid_statements)
+        ),
+    ]
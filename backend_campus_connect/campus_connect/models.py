@@ -1,7 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 import uuid
 
 
@@ -19,7 +22,8 @@ class User(AbstractUser):
     course = models.CharField(max_length=100, blank=True, null=True)
     year = models.PositiveIntegerField(null=True, blank=True)
     profile_picture = models.ImageField(upload_to=user_profile_path, null=True, blank=True)
-    last_seen = models.DateTimeField(auto_now=True)
+    # Maintained by the presence tracker's periodic flush, see presence.py
+    last_seen = models.DateTimeField(default=timezone.now)
     is_online = models.BooleanField(default=False)
     # bio = models.TextField(max_length=500, blank=True)
 
@@ -72,6 +76,9 @@ class Post(models.Model):
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES)
     image = models.ImageField(upload_to='post_images/', blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized counters, maintained by the signals in campus_connect/signals.py
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.title
@@ -143,6 +150,28 @@ class MarketplaceItem(models.Model):
     is_sold = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Browsing only ever shows unsold items, so the browse indexes skip
+        # sold ones; one per sort order, with and without a category filter
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'], condition=models.Q(is_sold=False),
+                name='marketplace_recent_idx',
+            ),
+            models.Index(
+                fields=['category', '-created_at', '-id'], condition=models.Q(is_sold=False),
+                name='marketplace_cat_recent_idx',
+            ),
+            models.Index(
+                fields=['price', 'id'], condition=models.Q(is_sold=False),
+                name='marketplace_price_idx',
+            ),
+            models.Index(
+                fields=['category', 'price', 'id'], condition=models.Q(is_sold=False),
+                name='marketplace_cat_price_idx',
+            ),
+        ]
+
     def __str__(self):
         return self.title
     
@@ -200,6 +229,30 @@ class Connection(models.Model):
         return f"{self.user1.username} <-> {self.user2.username}"
 
 
+class ChatRoomQuerySet(models.QuerySet):
+    def for_user(self, user):
+        """Rooms the given user takes part in"""
+        return self.filter(models.Q(user1=user) | models.Q(user2=user))
+
+    def inbox(self, user):
+        """
+        Rooms of `user` with both participants and the last message joined
+        in and the user's own unread counter picked out, so the whole inbox
+        is read from the denormalized ChatRoom columns in a single query.
+        """
+        return (
+            self.for_user(user)
+            .select_related('user1', 'user2', 'last_message')
+            .annotate(
+                unread_total=models.Case(
+                    models.When(user1=user, then=models.F('user1_unread_count')),
+                    default=models.F('user2_unread_count'),
+                ),
+            )
+            .order_by('-updated_at')
+        )
+
+
 class ChatRoom(models.Model):
     """
     Represents a chat room between two connected users
@@ -212,6 +265,20 @@ class ChatRoom(models.Model):
     is_group = models.BooleanField(default=False)
     group_name = models.CharField(max_length=100, blank=True)
     # participants = models.ManyToManyField(User, through='ChatRoomMembership')
+
+    # Inbox state, written in the same transaction as each Message insert
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_preview = models.CharField(max_length=255, blank=True)
+    user1_unread_count = models.PositiveIntegerField(default=0)
+    user2_unread_count = models.PositiveIntegerField(default=0)
+    # Read cursors: everything a participant received up to last_read_at
+    # counts as read, so marking a room read is a write to this row only
+    user1_last_read_at = models.DateTimeField(null=True, blank=True)
+    user2_last_read_at = models.DateTimeField(null=True, blank=True)
+    user1_last_read_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    user2_last_read_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    objects = ChatRoomQuerySet.as_manager()
     
     class Meta:
         unique_together = ('user1', 'user2')
@@ -233,6 +300,144 @@ class ChatRoom(models.Model):
     def get_other_user(self, current_user):
         """Get the other user in the chat room"""
         return self.user2 if self.user1 == current_user else self.user1
+
+    def unread_field_for(self, user_id):
+        """Name of the unread counter column belonging to the given participant"""
+        return 'user1_unread_count' if user_id == self.user1_id else 'user2_unread_count'
+
+    def unread_count_for(self, user):
+        return getattr(self, self.unread_field_for(user.id))
+
+    def participant_prefix(self, user_id):
+        return 'user1' if user_id == self.user1_id else 'user2'
+
+    def last_read_at_for(self, user_id):
+        return getattr(self, f'{self.participant_prefix(user_id)}_last_read_at')
+
+    def recipient_id_for(self, message):
+        return self.user2_id if message.sender_id == self.user1_id else self.user1_id
+
+    def is_read_by_recipient(self, message):
+        """Whether the participant who received `message` has read it, per their cursor"""
+        cursor = self.last_read_at_for(self.recipient_id_for(message))
+        return message.is_read or (cursor is not None and message.created_at <= cursor)
+
+    def read_at_for_recipient(self, message):
+        """
+        When the recipient read `message`: the row's own read_at if it has
+        one, otherwise the read cursor that covers it (None while unread).
+        """
+        if message.read_at is not None:
+            return message.read_at
+        cursor = self.last_read_at_for(self.recipient_id_for(message))
+        if cursor is not None and message.created_at <= cursor:
+            return cursor
+        return None
+
+    def add_message(self, sender, **fields):
+        """
+        Create a message and update the room's last message, preview and the
+        recipient's unread counter atomically with the insert.
+        """
+        with transaction.atomic():
+            message = Message.objects.create(chat_room=self, sender=sender, **fields)
+            recipient_id = self.user2_id if sender.id == self.user1_id else self.user1_id
+            unread_field = self.unread_field_for(recipient_id)
+            ChatRoom.objects.filter(pk=self.pk).update(
+                last_message=message,
+                last_message_preview=message.preview,
+                updated_at=message.created_at,
+                **{unread_field: models.F(unread_field) + 1},
+            )
+        return message
+
+    def remove_message(self, message):
+        """Delete a message and repair the inbox state if it referenced it"""
+        with transaction.atomic():
+            message_id = message.id
+            message.delete()
+            if not self.is_read_by_recipient(message):
+                unread_field = self.unread_field_for(self.recipient_id_for(message))
+                ChatRoom.objects.filter(pk=self.pk, **{f'{unread_field}__gt': 0}).update(
+                    **{unread_field: models.F(unread_field) - 1}
+                )
+            if self.last_message_id == message_id:
+                latest = self.messages.order_by('-created_at', '-id').first()
+                ChatRoom.objects.filter(pk=self.pk).update(
+                    last_message=latest,
+                    last_message_preview=latest.preview if latest else '',
+                )
+
+    def mark_read_by(self, user, up_to=None):
+        """
+        Move `user`'s read cursor forward to `up_to` (default: now) and
+        re-derive their unread counter from it.
+
+        This is a single-row UPDATE on the room however many messages it
+        covers; the cursor never moves backwards. Returns 1 if it advanced.
+        """
+        now = timezone.now()
+        cursor = min(up_to, now) if up_to is not None else now
+        prefix = self.participant_prefix(user.id)
+        received = Message.objects.filter(chat_room=OuterRef('pk')).exclude(sender=user)
+        unread = (
+            received.filter(created_at__gt=cursor)
+            .order_by()
+            .values('chat_room')
+            .annotate(total=Count('pk'))
+            .values('total')
+        )
+        last_read = (
+            received.filter(created_at__lte=cursor)
+            .order_by('-created_at', '-id')
+            .values('id')[:1]
+        )
+        return ChatRoom.objects.filter(
+            models.Q(**{f'{prefix}_last_read_at__isnull': True})
+            | models.Q(**{f'{prefix}_last_read_at__lt': cursor}),
+            pk=self.pk,
+        ).update(**{
+            f'{prefix}_last_read_at': cursor,
+            f'{prefix}_last_read_message': Subquery(last_read),
+            f'{prefix}_unread_count': Coalesce(Subquery(unread, output_field=IntegerField()), Value(0)),
+        })
+
+    RECEIPT_STATUSES = ('delivered', 'read')
+
+    def apply_receipt(self, user, status, message_ids=None, up_to=None):
+        """
+        Mark messages `user` received in this room as delivered or read:
+        the given ids, everything sent up to the `up_to` watermark, or with
+        neither, everything so far.
+
+        Delivery is one UPDATE over the batch and only moves status forward
+        (sent -> delivered). Reads just advance the user's read cursor to
+        the newest message covered, see mark_read_by, so reading some ids
+        reads everything received before them too (read_watermark gives
+        the resulting cursor). Returns the number of rows changed.
+        """
+        now = timezone.now()
+        if status == 'read':
+            if message_ids is not None:
+                up_to = self.read_watermark(user, message_ids)
+                if up_to is None:
+                    return 0
+            return self.mark_read_by(user, up_to=up_to)
+
+        messages = Message.objects.filter(chat_room=self).exclude(sender=user)
+        if message_ids is not None:
+            messages = messages.filter(id__in=message_ids)
+        elif up_to is not None:
+            messages = messages.filter(created_at__lte=min(up_to, now))
+        return messages.filter(status='sent').update(status='delivered', delivered_at=now)
+
+    def read_watermark(self, user, message_ids):
+        """Where reading `message_ids` moves `user`'s cursor: the newest of them they received"""
+        return (
+            Message.objects.filter(chat_room=self, id__in=message_ids)
+            .exclude(sender=user)
+            .aggregate(latest=models.Max('created_at'))['latest']
+        )
     
     def __str__(self):
         return f"Chat: {self.user1.username} <-> {self.user2.username}"
@@ -263,6 +468,7 @@ class Message(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='sent')
     delivered_at = models.DateTimeField(null=True, blank=True)
     read_at = models.DateTimeField(null=True, blank=True)
+    # Only set on rows read before read cursors existed; see ChatRoom.is_read_by_recipient
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -277,8 +483,55 @@ class Message(models.Model):
         indexes = [
             models.Index(fields=['chat_room', '-created_at']),
             models.Index(fields=['sender', 'status']),
-            models.Index(fields=['is_read', 'chat_room']),
         ]
     
+    PREVIEW_LENGTH = 100
+
+    @property
+    def preview(self):
+        """Short text shown for this message in the chat inbox"""
+        if self.message_type == 'text' or self.content:
+            return self.content[:self.PREVIEW_LENGTH]
+        return f"[{self.get_message_type_display()}]"
+
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}..."
+
+
+class SearchDocument(models.Model):
+    """
+    Denormalized, searchable copy of a post, marketplace item, lost & found
+    report, club or event, so campus search is one indexed query over one
+    table. Rows are written by the signals in campus_connect/signals.py and
+    carry a full-text index on title (weighted highest) and body, see
+    campus_connect/search.py.
+    """
+    DOC_TYPES = [
+        ('post', 'Post'),
+        ('marketplace', 'Marketplace Item'),
+        ('lost_found', 'Lost & Found Item'),
+        ('club', 'Club'),
+        ('event', 'Event'),
+    ]
+
+    doc_type = models.CharField(max_length=20, choices=DOC_TYPES)
+    object_id = models.PositiveBigIntegerField()
+    title = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    # Category, or status for lost & found
+    category = models.CharField(max_length=50, blank=True)
+    # Hidden from search without being deleted, e.g. sold items
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doc_type', 'object_id'], name='unique_search_document'),
+        ]
+        indexes = [
+            models.Index(fields=['doc_type', 'category']),
+        ]
+
+    def __str__(self):
+        return f"{self.doc_type}:{self.object_id} {self.title}"
@@ -0,0 +1,274 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def keyset_filter(ordering, position):
+    """
+    Build the Q object selecting every row that sorts after ``position``.
+
+    ``ordering`` is a sequence of field names as passed to ``order_by()``
+    (a leading '-' means descending) and ``position`` holds the values of
+    those fields for the last row already returned. For ('-created_at', '-id')
+    this expands to ``created_at < c OR (created_at = c AND id < i)``, which
+    the database can answer straight from an index on those columns.
+    """
+    query = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        clause = Q(**{f'{name}__{lookup}': position[index]})
+        for previous_field, value in zip(ordering[:index], position[:index]):
+            clause &= Q(**{previous_field.lstrip('-'): value})
+        query |= clause
+    return query
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on the ordering columns instead of an OFFSET.
+
+    Every page is a single indexed range scan no matter how deep the client
+    has scrolled, and no COUNT(*) is issued. Pagination is opt-in: it only
+    kicks in when the request carries a cursor or a page size, so existing
+    clients that expect a plain list keep working.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+
+    def is_requested(self, request):
+        return (
+            self.cursor_query_param in request.query_params
+            or self.page_size_query_param in request.query_params
+        )
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view=None):
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = self.filter_after(queryset, self.ordering, position)
+
+        results = list(queryset.order_by(*self.ordering)[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def filter_after(self, queryset, ordering, position):
+        """Rows after `position`, treating values that don't fit the columns as a bad cursor"""
+        try:
+            return queryset.filter(keyset_filter(ordering, position))
+        except (ValueError, ValidationError):
+            raise NotFound('Invalid cursor')
+
+    def get_position(self, obj):
+        return [
+            str(getattr(obj, field.lstrip('-'))) for field in self.ordering
+        ]
+
+    def encode_cursor(self, position):
+        raw = json.dumps(position, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound('Invalid cursor')
+        return self.check_position(position)
+
+    def check_position(self, position):
+        """Return the decoded cursor's position, or reject it if it cannot be one"""
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        return position
+
+    def get_next_cursor(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]))
+
+    def get_next_link(self):
+        cursor = self.get_next_cursor()
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.get_next_cursor(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'next_cursor': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class PostFeedPagination(KeysetPagination):
+    """Home feed, newest first"""
+    ordering = ('-created_at', '-id')
+
+
+class MarketplacePagination(KeysetPagination):
+    """
+    Marketplace browse, in the sort order the view picked from `sort`.
+
+    The cursor leads with that ordering: its values mean nothing under
+    another sort, so a cursor replayed with a different `sort` is rejected
+    rather than silently skipping or repeating items.
+    """
+
+    def get_ordering(self, request, queryset, view=None):
+        return view.get_ordering()
+
+    def ordering_tag(self):
+        return ','.join(self.ordering)
+
+    def get_position(self, obj):
+        return [self.ordering_tag(), *super().get_position(obj)]
+
+    def check_position(self, position):
+        if not isinstance(position, list) or not position or position[0] != self.ordering_tag():
+            raise NotFound('Invalid cursor for this sort')
+        return super().check_position(position[1:])
+
+
+class StudentPagination(KeysetPagination):
+    """Student discovery, alphabetical by username"""
+    ordering = ('username', 'id')
+
+
+class MessageKeysetPagination(KeysetPagination):
+    """
+    Chat history keyed on (created_at, id), served by the
+    Message(chat_room, -created_at) index.
+
+    `before=<message id>` returns the page of older messages preceding that
+    message and `after=<message id>` the newer ones following it; an empty
+    `before=` starts from the newest message. Both directions are returned
+    newest first, and every page costs the same however far back it lies.
+    """
+    before_query_param = 'before'
+    after_query_param = 'after'
+
+    def is_requested(self, request):
+        return (
+            self.before_query_param in request.query_params
+            or self.after_query_param in request.query_params
+        )
+
+    def get_anchor(self, queryset, message_id):
+        try:
+            anchor = queryset.filter(pk=message_id).values_list(
+                *[field.lstrip('-') for field in self.ordering]
+            ).first()
+        except (ValueError, ValidationError):
+            raise NotFound('Invalid message id')
+        if anchor is None:
+            raise NotFound('Anchor message not found')
+        return list(anchor)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+        self.reverse = bool(after) and not before
+
+        ordering = self.ordering
+        position = None
+        if self.reverse:
+            # Walk forward in time from the anchor, then flip back to newest first
+            ordering = tuple(
+                field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering
+            )
+            position = self.get_anchor(queryset, after)
+        elif before:
+            position = self.get_anchor(queryset, before)
+
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(ordering, position))
+
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        self.has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+        self.page = results
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'has_more': self.has_more,
+            'oldest_id': str(self.page[-1].pk) if self.page else None,
+            'newest_id': str(self.page[0].pk) if self.page else None,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'has_more': {'type': 'boolean'},
+                'oldest_id': {'type': 'string', 'nullable': True},
+                'newest_id': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class SearchPagination(KeysetPagination):
+    """
+    Message and campus search hits, best match first. The relevance `rank`
+    annotation leads the cursor so every page continues exactly where the
+    last one ended. Search results are always paginated.
+    """
+    ordering = ('-rank', '-created_at', '-id')
+
+    def is_requested(self, request):
+        return True
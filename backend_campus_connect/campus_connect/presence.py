@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import User, Connection
+
+logger = logging.getLogger(__name__)
+
+
+def user_group_name(user_id):
+    """Channel layer group every socket of a user joins, for per-user events"""
+    return f'user_{user_id}'
+
+
+class RedisPresenceStore:
+    """
+    Presence state in redis, shared by every ASGI worker.
+
+    `presence:sockets:<user_id>` is a sorted set of the user's socket
+    channel names scored by when each expires, and `presence:users` indexes
+    users by their latest expiry so a sweep only looks at users who may have
+    lapsed. `presence:seen` buffers last_seen times until the next flush.
+    """
+    users_key = 'presence:users'
+    seen_key = 'presence:seen'
+
+    def __init__(self, client):
+        self.client = client
+
+    def sockets_key(self, user_id):
+        return f'presence:sockets:{user_id}'
+
+    def register(self, user_id, channel_name, expires_at, now):
+        """Add or renew a socket; returns (whether it was new, live socket count)"""
+        key = self.sockets_key(user_id)
+        pipe = self.client.pipeline()
+        pipe.zadd(key, {channel_name: expires_at})
+        pipe.zremrangebyscore(key, 0, now)
+        pipe.zcard(key)
+        pipe.zadd(self.users_key, {user_id: expires_at}, gt=True)
+        pipe.hset(self.seen_key, user_id, now)
+        added, _expired, count, _indexed, _seen = pipe.execute()
+        return bool(added), count
+
+    def unregister(self, user_id, channel_name, now):
+        """Drop a socket; returns (whether it was still live, live socket count)"""
+        key = self.sockets_key(user_id)
+        pipe = self.client.pipeline()
+        pipe.zrem(key, channel_name)
+        pipe.zremrangebyscore(key, 0, now)
+        pipe.zcard(key)
+        pipe.hset(self.seen_key, user_id, now)
+        removed, _expired, count, _seen = pipe.execute()
+        return bool(removed), count
+
+    def online_user_ids(self, user_ids, now):
+        user_ids = list(user_ids)
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zcount(self.sockets_key(user_id), f'({now}', '+inf')
+        return {user_id for user_id, count in zip(user_ids, pipe.execute()) if count}
+
+    def expire(self, now):
+        """Drop lapsed sockets; returns the users left with none because of it"""
+        offline = []
+        for member in self.client.zrangebyscore(self.users_key, 0, now):
+            user_id = int(member)
+            key = self.sockets_key(user_id)
+            pipe = self.client.pipeline()
+            pipe.zremrangebyscore(key, 0, now)
+            pipe.zrange(key, -1, -1, withscores=True)
+            expired, latest = pipe.execute()
+            if latest:
+                # A socket renewed after the index entry was read
+                self.client.zadd(self.users_key, {user_id: latest[0][1]}, gt=True)
+                continue
+            self.client.zrem(self.users_key, user_id)
+            # Nothing expired means the last socket disconnected cleanly and
+            # the user was already reported offline
+            if expired:
+                offline.append(user_id)
+        return offline
+
+    def pop_seen(self):
+        """Take the buffered {user_id: last seen timestamp}"""
+        pipe = self.client.pipeline()
+        pipe.hgetall(self.seen_key)
+        pipe.delete(self.seen_key)
+        seen, _deleted = pipe.execute()
+        return {int(user_id): float(seen_at) for user_id, seen_at in seen.items()}
+
+
+class LocalPresenceStore:
+    """
+    The same state in process memory, for development without redis (where
+    the in-memory channel layer already limits chat to one process).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sockets = {}
+        self._seen = {}
+
+    def _live(self, user_id, now):
+        sockets = self._sockets.get(user_id, {})
+        return {name: expires_at for name, expires_at in sockets.items() if expires_at > now}
+
+    def register(self, user_id, channel_name, expires_at, now):
+        with self._lock:
+            added = channel_name not in self._sockets.get(user_id, {})
+            self._sockets.setdefault(user_id, {})[channel_name] = expires_at
+            sockets = self._sockets[user_id] = self._live(user_id, now)
+            self._seen[user_id] = now
+            return added, len(sockets)
+
+    def unregister(self, user_id, channel_name, now):
+        with self._lock:
+            removed = self._sockets.get(user_id, {}).pop(channel_name, None) is not None
+            sockets = self._live(user_id, now)
+            if sockets:
+                self._sockets[user_id] = sockets
+            else:
+                self._sockets.pop(user_id, None)
+            self._seen[user_id] = now
+            return removed, len(sockets)
+
+    def online_user_ids(self, user_ids, now):
+        with self._lock:
+            return {user_id for user_id in user_ids if self._live(user_id, now)}
+
+    def expire(self, now):
+        offline = []
+        with self._lock:
+            for user_id in list(self._sockets):
+                live = self._live(user_id, now)
+                if live:
+                    self._sockets[user_id] = live
+                else:
+                    del self._sockets[user_id]
+                    offline.append(user_id)
+        return offline
+
+    def pop_seen(self):
+        with self._lock:
+            seen, self._seen = self._seen, {}
+        return seen
+
+
+class PresenceTracker:
+    """
+    Who is online, tracked per socket outside the database.
+
+    Every socket (across tabs, devices and ASGI workers) is registered under
+    its channel name with an expiry PRESENCE_TTL ahead, which its heartbeats
+    push back. A user is online while any of their sockets is live; the
+    first socket coming up and the last one going away are the changes that
+    get broadcast.
+
+    `sweep` runs every PRESENCE_FLUSH_INTERVAL on each worker. It reports
+    users whose last socket lapsed without a disconnect (a crashed worker or
+    a dropped network) as offline, and writes the buffered last_seen /
+    is_online values in one bulk UPDATE instead of once per connect,
+    disconnect or heartbeat. The state lives in redis when the cache does,
+    so a sweep on any worker sees every socket.
+    """
+
+    def __init__(self):
+        self.ttl = getattr(settings, 'PRESENCE_TTL', 90)
+        self.flush_interval = getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 30)
+        self._store = None
+        self._sweepers = {}
+
+    @property
+    def store(self):
+        if self._store is None:
+            if settings.CACHES['default']['BACKEND'].startswith('django_redis'):
+                from django_redis import get_redis_connection
+                self._store = RedisPresenceStore(get_redis_connection('default'))
+            else:
+                self._store = LocalPresenceStore()
+        return self._store
+
+    def connect(self, user_id, channel_name):
+        """Register a new socket; returns True when the user just came online"""
+        now = time.time()
+        added, count = self.store.register(user_id, channel_name, now + self.ttl, now)
+        return added and count == 1
+
+    def heartbeat(self, user_id, channel_name):
+        """
+        Keep a socket alive for another TTL. Returns True when a sweep had
+        already expired the socket and the user comes back online with it.
+        """
+        return self.connect(user_id, channel_name)
+
+    def disconnect(self, user_id, channel_name):
+        """Drop a socket; returns True when it was the user's last live one"""
+        removed, count = self.store.unregister(user_id, channel_name, time.time())
+        return removed and count == 0
+
+    def is_online(self, user_id):
+        return user_id in self.online_user_ids([user_id])
+
+    def online_user_ids(self, user_ids):
+        """The subset of user_ids that currently have a live socket"""
+        return self.store.online_user_ids(user_ids, time.time())
+
+    def sweep(self):
+        """
+        Expire lapsed sockets and write buffered presence to the database;
+        returns the ids of users who went offline by expiry.
+        """
+        now = time.time()
+        offline = self.store.expire(now)
+        seen = self.store.pop_seen()
+        if seen:
+            online = self.online_user_ids(seen)
+            users = [
+                User(
+                    id=user_id,
+                    last_seen=datetime.fromtimestamp(seen_at, tz=dt_timezone.utc),
+                    is_online=user_id in online,
+                )
+                for user_id, seen_at in seen.items()
+            ]
+            User.objects.bulk_update(users, ['last_seen', 'is_online'], batch_size=500)
+        unseen = [user_id for user_id in offline if user_id not in seen]
+        if unseen:
+            # Lapsed without activity since the last flush; last_seen stands
+            User.objects.filter(id__in=unseen).update(is_online=False)
+        return offline
+
+    def ensure_sweeper(self, channel_layer):
+        """Start the periodic sweep on the running event loop, once per loop"""
+        loop = asyncio.get_running_loop()
+        task = self._sweepers.get(loop)
+        if task is None or task.done():
+            self._sweepers[loop] = loop.create_task(self._sweep_periodically(channel_layer))
+
+    async def _sweep_periodically(self, channel_layer):
+        sweep = database_sync_to_async(self.sweep)
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                for user_id in await sweep():
+                    await self.broadcast(channel_layer, user_id, False)
+            except Exception as e:
+                logger.error(f"Error sweeping presence: {str(e)}")
+
+    @database_sync_to_async
+    def connection_ids(self, user_id):
+        """Ids of the users connected to user_id, who receive its presence changes"""
+        pairs = Connection.objects.filter(
+            Q(user1_id=user_id) | Q(user2_id=user_id)
+        ).values_list('user1_id', 'user2_id')
+        return [other for pair in pairs for other in pair if other != user_id]
+
+    async def broadcast(self, channel_layer, user_id, is_online):
+        """Tell the user's connections (only) that they came online or went offline"""
+        event = {
+            'type': 'user_presence',
+            'user_id': user_id,
+            'is_online': is_online,
+            'last_seen': timezone.now().isoformat(),
+        }
+        for other_id in await self.connection_ids(user_id):
+            await channel_layer.group_send(user_group_name(other_id), event)
+
+
+presence = PresenceTracker()
+
+# Store calls may hit redis, so keep them off the event loop
+presence_connect = sync_to_async(presence.connect)
+presence_heartbeat = sync_to_async(presence.heartbeat)
+presence_disconnect = sync_to_async(presence.disconnect)
@@ -0,0 +1,242 @@
+"""
+Full-text search over chat messages and the campus-wide SearchDocument table.
+
+PostgreSQL keeps a generated ``search_vector`` tsvector column on each
+indexed table behind a GIN index; SQLite (development) keeps an FTS5
+table filled by triggers. Both are created by migrations (0011 for
+messages, 0012 for search documents) and stay in step with inserts, edits
+and deletes inside the database, so the application never writes to the
+index itself. The FTS5 tables are keyed on the row's primary key, not its
+rowid, which VACUUM may renumber on tables with UUID keys (0014). Other
+backends fall back to a (slow) substring match.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, Count, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import (
+    ChatRoom, Message, SearchDocument, Post, MarketplaceItem, LostAndFoundItem, Club, Event
+)
+
+# Text search configuration baked into the PostgreSQL generated columns
+SEARCH_CONFIG = 'english'
+
+
+class FullTextIndex:
+    """Where a table's full-text index lives and how its columns are weighted"""
+
+    def __init__(self, table, columns, weights, key='id'):
+        self.table = table
+        self.columns = columns
+        self.key = key
+        # bm25() column weights on SQLite; PostgreSQL weights are set with
+        # setweight() in the generated column instead
+        self.weights = weights
+        self.fts_table = f'{table}_fts'
+
+    @property
+    def triggers(self):
+        return {f'{self.fts_table}_ai', f'{self.fts_table}_ad', f'{self.fts_table}_au'}
+
+    def sqlite_statements(self):
+        columns = ', '.join(self.columns)
+        new_values = ', '.join(f'new.{column}' for column in self.columns)
+        delete = f"DELETE FROM {self.fts_table} WHERE {self.key} = old.{self.key};"
+        insert = (
+            f"INSERT INTO {self.fts_table}({columns}, {self.key}) "
+            f"VALUES ({new_values}, new.{self.key});"
+        )
+        return [
+            # The key goes last so bm25() weights line up with self.columns
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.fts_table} USING fts5("
+            f"{columns}, {self.key} UNINDEXED, tokenize='porter unicode61')",
+            f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_ai AFTER INSERT ON {self.table} "
+            f"BEGIN {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_ad AFTER DELETE ON {self.table} "
+            f"BEGIN {delete} END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_au AFTER UPDATE OF {columns} ON {self.table} "
+            f"BEGIN {delete} {insert} END",
+        ]
+
+    def ensure_sqlite(self, cursor):
+        """
+        (Re)create the FTS table and triggers if they are missing, and
+        rebuild the index when they had to be put back.
+        """
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s",
+            [self.table],
+        )
+        if self.triggers <= {row[0] for row in cursor.fetchall()}:
+            return
+        for statement in self.sqlite_statements():
+            cursor.execute(statement)
+        self.rebuild_sqlite(cursor)
+
+    def rebuild_sqlite(self, cursor):
+        """Refill the FTS table from the indexed table"""
+        columns = ', '.join(self.columns)
+        cursor.execute(f"DELETE FROM {self.fts_table}")
+        cursor.execute(
+            f"INSERT INTO {self.fts_table}({columns}, {self.key}) "
+            f"SELECT {columns}, {self.key} FROM {self.table}"
+        )
+
+    def search(self, queryset, text):
+        """Filter `queryset` (over this table) to rows matching `text`, annotated with `rank`"""
+        vendor = connections[queryset.db].vendor
+
+        if vendor == 'postgresql':
+            tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+            return queryset.filter(
+                RawSQL(f'"{self.table}"."search_vector" @@ {tsquery}', (text,), output_field=BooleanField())
+            ).annotate(
+                rank=RawSQL(
+                    f'ts_rank("{self.table}"."search_vector", {tsquery})::float8',
+                    (text,),
+                    output_field=FloatField(),
+                )
+            )
+
+        if vendor == 'sqlite':
+            query = fts5_query(text)
+            if query is None:
+                return queryset.annotate(rank=Value(0.0, output_field=FloatField())).none()
+            weights = ', '.join(str(weight) for weight in self.weights)
+            return queryset.filter(
+                RawSQL(
+                    f'"{self.table}"."{self.key}" IN (SELECT {self.key} FROM {self.fts_table} '
+                    f'WHERE {self.fts_table} MATCH %s)',
+                    (query,),
+                    output_field=BooleanField(),
+                )
+            ).annotate(
+                # bm25() is lower-is-better, flip it to match PostgreSQL
+                rank=RawSQL(
+                    f'(SELECT -bm25({self.fts_table}, {weights}) FROM {self.fts_table} '
+                    f'WHERE {self.fts_table} MATCH %s AND {self.key} = "{self.table}"."{self.key}")',
+                    (query,),
+                    output_field=FloatField(),
+                )
+            )
+
+        matches = Q()
+        for column in self.columns:
+            matches |= Q(**{f'{column}__icontains': text})
+        return queryset.filter(matches).annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+def join_text(*parts):
+    return '\n'.join(part for part in parts if part)
+
+
+# How each searchable model maps onto a SearchDocument
+DOCUMENT_SOURCES = {
+    Post: ('post', lambda post: {
+        'title': post.title,
+        'body': post.content,
+        'category': post.category,
+        'created_at': post.created_at,
+    }),
+    MarketplaceItem: ('marketplace', lambda item: {
+        'title': item.title,
+        'body': item.description,
+        'category': item.category,
+        'is_active': not item.is_sold,
+        'created_at': item.created_at,
+    }),
+    LostAndFoundItem: ('lost_found', lambda item: {
+        'title': item.title,
+        'body': join_text(item.description, item.location),
+        'category': item.status,
+        'created_at': item.created_at,
+    }),
+    Club: ('club', lambda club: {
+        'title': club.name,
+        'body': club.description,
+        'category': club.category,
+    }),
+    Event: ('event', lambda event: {
+        'title': event.title,
+        'body': join_text(event.description, event.location),
+        'category': event.category,
+        'created_at': event.start_time,
+    }),
+}
+
+
+def index_document(instance):
+    """Create or refresh the search document of a post, item, club or event"""
+    doc_type, build = DOCUMENT_SOURCES[type(instance)]
+    SearchDocument.objects.update_or_create(
+        doc_type=doc_type, object_id=instance.pk, defaults=build(instance)
+    )
+
+
+def remove_document(instance):
+    doc_type, _build = DOCUMENT_SOURCES[type(instance)]
+    SearchDocument.objects.filter(doc_type=doc_type, object_id=instance.pk).delete()
+
+
+MESSAGE_INDEX = FullTextIndex(Message._meta.db_table, ('content',), (1.0,))
+DOCUMENT_INDEX = FullTextIndex(SearchDocument._meta.db_table, ('title', 'body'), (10.0, 1.0))
+FULL_TEXT_INDEXES = [MESSAGE_INDEX, DOCUMENT_INDEX]
+
+
+def ensure_sqlite_search_indexes(using='default'):
+    """
+    Django's SQLite schema editor rebuilds a table for many ALTERs, which
+    drops its triggers, so this runs after every migrate to put them back.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for index in FULL_TEXT_INDEXES:
+            index.ensure_sqlite(cursor)
+
+
+def fts5_query(text):
+    """
+    Turn free text into a safe FTS5 query: every word must match, the last
+    one as a prefix so results show up while the user is still typing.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_messages(user, text, using='default'):
+    """
+    Messages in the rooms of `user` matching `text`, annotated with a
+    relevance `rank` (higher is better). Order by ('-rank', '-created_at',
+    '-id') to page through the results.
+    """
+    messages = Message.objects.using(using).filter(
+        chat_room__in=ChatRoom.objects.for_user(user).values('id')
+    )
+    return MESSAGE_INDEX.search(messages, text)
+
+
+def search_documents(text, using='default'):
+    """
+    Active search documents matching `text`, title hits weighted above body
+    hits, annotated with a relevance `rank`. Order by ('-rank',
+    '-created_at', '-id') to page through the results.
+    """
+    documents = SearchDocument.objects.using(using).filter(is_active=True)
+    return DOCUMENT_INDEX.search(documents, text)
+
+
+def document_facets(matches):
+    """{doc_type: count} over all matches, from a single GROUP BY"""
+    counts = dict.fromkeys((doc_type for doc_type, _label in SearchDocument.DOC_TYPES), 0)
+    counts.update(
+        matches.order_by().values_list('doc_type').annotate(total=Count('id')).values_list('doc_type', 'total')
+    )
+    return counts
@@ -3,7 +3,7 @@ from .models import(
     ChatRoom, User, Club, Event, Post, 
     Comment, PostLike, PostReport, LostAndFoundItem, MarketplaceItem,  
     ConnectionRequest, Connection,
-    Message, ChatRoom,
+    Message, ChatRoom, SearchDocument,
 )
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
@@ -235,8 +235,8 @@ class CommentSerializer(serializers.ModelSerializer):
 class PostSerializer(serializers.ModelSerializer):
     author_name = serializers.CharField(source='author.username', read_only=True)
     author_avatar = serializers.CharField(source='user.profile_picture', read_only=True)
-    likes_count = serializers.IntegerField(source='likes.count', read_only=True)
-    comments_count = serializers.IntegerField(source='comments.count', read_only=True)
+    likes_count = serializers.IntegerField(read_only=True)
+    comments_count = serializers.IntegerField(read_only=True)
     comments = CommentSerializer(many=True, read_only=True)
     # comments = CommentSerializer(many=True, read_only=True, source='comments_root')
     image = serializers.ImageField(required=False, allow_null=True)
@@ -248,16 +248,19 @@ class PostSerializer(serializers.ModelSerializer):
             'author_name', 'author_avatar', 'likes_count', 
             'comments_count', 'comments', 'image', 'is_liked_by_user'
         ]
-        
-        
-    def get_likes_count(self, obj):
-        return obj.likes.count()
 
-    def get_comments_count(self, obj):
-        # Assuming you have a Comment model with a foreign key to Post
-        return obj.comments.count() if hasattr(obj, 'comments') else 0
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Feed pages can ask to leave the nested comments out entirely
+        if self.context.get('omit_comments'):
+            self.fields.pop('comments', None)
 
     def get_is_liked_by_user(self, obj):
+        # List views resolve the whole page in one query and pass the ids in
+        liked_post_ids = self.context.get('liked_post_ids')
+        if liked_post_ids is not None:
+            return obj.pk in liked_post_ids
+
         request = self.context.get('request')
         if request and hasattr(request, 'user') and request.user.is_authenticated:
             return obj.likes.filter(user=request.user).exists()
@@ -440,19 +443,68 @@ class ConnectionSerializer(serializers.ModelSerializer):
 
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageReadStateMixin(serializers.Serializer):
+    """
+    Read state derived from the room's read cursors rather than the per-row
+    columns, which reads no longer write. Pass the room as
+    context['chat_room'] when serializing a page so it is not fetched once
+    per message.
+    """
+    is_read = serializers.SerializerMethodField()
+    status = serializers.SerializerMethodField()
+    read_at = serializers.SerializerMethodField()
+
+    def room_for(self, obj):
+        return self.context.get('chat_room') or obj.chat_room
+
+    def get_is_read(self, obj):
+        return self.room_for(obj).is_read_by_recipient(obj)
+
+    def get_status(self, obj):
+        return 'read' if self.get_is_read(obj) else obj.status
+
+    def get_read_at(self, obj):
+        read_at = self.room_for(obj).read_at_for_recipient(obj)
+        return serializers.DateTimeField().to_representation(read_at) if read_at else None
+
+
+class MessageSerializer(MessageReadStateMixin, serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
-    sender_profile = UserProfileSerializer(source='sender.user', read_only=True)
     
     class Meta:
         model = Message
         fields = [
-            'id', 'chat_room', 'sender', 'sender_profile', 'message_type', 
+            'id', 'chat_room', 'sender', 'message_type', 
             'content', 'file', 'is_read', 'created_at', 'updated_at', 
             'delivered_at', 'status', 'read_at', 'reply_to', 'reactions', 'thumbnail', 
             'duration', 'file_size'
         ]
 
+class MessageCompactSerializer(MessageReadStateMixin, serializers.ModelSerializer):
+    """
+    Wire format for message pages: the sender is referenced by id only and
+    the page's participants are sent once alongside (see sideload_message_users).
+    The room is implied by the request, so it is not repeated per message.
+    """
+    sender_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Message
+        fields = [
+            'id', 'sender_id', 'message_type',
+            'content', 'file', 'is_read', 'created_at',
+            'delivered_at', 'status', 'read_at', 'reply_to', 'reactions', 'thumbnail',
+            'duration', 'file_size'
+        ]
+
+
+def sideload_message_users(messages, context=None):
+    """Serialize the distinct senders of `messages` once, keyed by user id"""
+    sender_ids = {message.sender_id for message in messages}
+    users = User.objects.filter(id__in=sender_ids)
+    return {str(user.id): UserListSerializer(user, context=context).data for user in users}
+
+
 class ChatRoomSerializer(serializers.ModelSerializer):
     user1 = UserSerializer(read_only=True)
     user2 = UserSerializer(read_only=True)
@@ -470,15 +522,14 @@ class ChatRoomSerializer(serializers.ModelSerializer):
                  'created_at', 'updated_at', 'is_group', 'group_name']
     
     def get_last_message(self, obj):
-        last_message = obj.messages.first()
-        if last_message:
-            return MessageSerializer(last_message).data
+        if obj.last_message:
+            return MessageSerializer(obj.last_message, context={**self.context, 'chat_room': obj}).data
         return None
     
     def get_unread_count(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
+            return obj.unread_count_for(request.user)
         return 0
     
     def get_other_user(self, obj):
@@ -495,4 +546,52 @@ class ChatRoomSerializer(serializers.ModelSerializer):
             return UserProfileSerializer(other_user).data
             # return UserProfileSerializer(other_user.user).data
         return None
-  
\ No newline at end of file
+  
+
+
+
+class ChatRoomInboxSerializer(serializers.ModelSerializer):
+    """
+    Inbox row built from the denormalized columns joined in by
+    ChatRoom.objects.inbox(), so serializing a room never touches the database.
+    """
+    other_user = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    unread_count = serializers.IntegerField(source='unread_total', read_only=True)
+
+    class Meta:
+        model = ChatRoom
+        fields = ['id', 'other_user', 'last_message', 'unread_count',
+                 'created_at', 'updated_at', 'is_group', 'group_name']
+
+    def get_other_user(self, obj):
+        request = self.context.get('request')
+        if request and request.user.is_authenticated:
+            other_user = obj.user2 if obj.user1_id == request.user.id else obj.user1
+            return UserSerializer(other_user, context=self.context).data
+        return None
+
+    def get_last_message(self, obj):
+        last_message = obj.last_message
+        if last_message is None:
+            return None
+        return {
+            'id': str(last_message.id),
+            'content': obj.last_message_preview,
+            'message_type': last_message.message_type,
+            'sender_id': last_message.sender_id,
+            'created_at': serializers.DateTimeField().to_representation(last_message.created_at),
+        }
+
+
+class SearchDocumentSerializer(serializers.ModelSerializer):
+    """Campus search hit; `object_id` is the id of the post, item, club or event"""
+    snippet = serializers.SerializerMethodField()
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = SearchDocument
+        fields = ['doc_type', 'object_id', 'title', 'snippet', 'category', 'created_at', 'rank']
+
+    def get_snippet(self, obj):
+        return obj.body[:200]
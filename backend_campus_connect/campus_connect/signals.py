@@ -0,0 +1,98 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from .middleware import websocket_user_cache_key
+from .facets import LOST_FOUND_FACETS_KEY, MARKETPLACE_FACETS_KEY, bump_facets_generation
+from .models import User, Post, PostLike, Comment, Connection, ChatRoom, MarketplaceItem, LostAndFoundItem
+from .search import DOCUMENT_SOURCES, ensure_sqlite_search_indexes, index_document, remove_document
+
+
+def adjust_post_counter(post_id, field, delta):
+    """Atomically shift one of the denormalized Post counters"""
+    posts = Post.objects.filter(pk=post_id)
+    if delta < 0:
+        # Never let a counter drift below zero
+        posts = posts.filter(**{f'{field}__gte': -delta})
+    posts.update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=PostLike)
+def post_like_created(sender, instance, created, **kwargs):
+    """Bump the like counter when a post is liked"""
+    if created:
+        adjust_post_counter(instance.post_id, 'likes_count', 1)
+
+@receiver(post_delete, sender=PostLike)
+def post_like_deleted(sender, instance, **kwargs):
+    """Drop the like counter when a like is removed"""
+    adjust_post_counter(instance.post_id, 'likes_count', -1)
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    """Bump the comment counter when a comment is added"""
+    if created:
+        adjust_post_counter(instance.post_id, 'comments_count', 1)
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    """Drop the comment counter when a comment is removed"""
+    adjust_post_counter(instance.post_id, 'comments_count', -1)
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    """Drop the websocket handshake's cached copy of a changed user"""
+    cache.delete(websocket_user_cache_key(instance.pk))
+
+@receiver(post_save, sender=MarketplaceItem)
+@receiver(post_delete, sender=MarketplaceItem)
+def marketplace_item_changed(sender, **kwargs):
+    """Retire the cached marketplace facets once a listing, sold or not, is written"""
+    transaction.on_commit(lambda: bump_facets_generation(MARKETPLACE_FACETS_KEY))
+
+@receiver(post_save, sender=LostAndFoundItem)
+@receiver(post_delete, sender=LostAndFoundItem)
+def lost_found_item_changed(sender, **kwargs):
+    """Retire the cached lost & found facets once a report is written"""
+    transaction.on_commit(lambda: bump_facets_generation(LOST_FOUND_FACETS_KEY))
+
+@receiver(post_delete, sender=Connection)
+def connection_removed(sender, instance, **kwargs):
+    """Tell open chat sockets of the pair to drop their cached room access"""
+    room_ids = list(ChatRoom.objects.filter(
+        user1_id=min(instance.user1_id, instance.user2_id),
+        user2_id=max(instance.user1_id, instance.user2_id),
+    ).values_list('id', flat=True))
+    if not room_ids:
+        return
+
+    def revoke():
+        channel_layer = get_channel_layer()
+        for room_id in room_ids:
+            async_to_sync(channel_layer.group_send)(f'chat_{room_id}', {'type': 'chat_room_revoked'})
+
+    transaction.on_commit(revoke)
+
+@receiver(post_migrate)
+def restore_search_indexes(sender, using, **kwargs):
+    """Put back the SQLite search triggers if a table rebuild dropped them"""
+    if sender.name == 'campus_connect':
+        ensure_sqlite_search_indexes(using)
+
+
+def update_search_document(sender, instance, raw=False, **kwargs):
+    """Keep the campus search document of a post, item, club or event current"""
+    if not raw:
+        index_document(instance)
+
+
+def delete_search_document(sender, instance, **kwargs):
+    remove_document(instance)
+
+
+for search_source in DOCUMENT_SOURCES:
+    post_save.connect(update_search_document, sender=search_source, dispatch_uid=f'search_{search_source.__name__}')
+    post_delete.connect(delete_search_document, sender=search_source, dispatch_uid=f'unsearch_{search_source.__name__}')
@@ -1,3 +1,911 @@
-from django.test import TestCase
+import base64
+import json
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from fakeredis.aioredis import FakeConnection
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from channels_redis.core import RedisChannelLayer
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from backend_campus_connect.asgi import application
+
+from .consumers import ChatConsumer
+from .facets import MARKETPLACE_FACETS_KEY, cached_facets, compute_marketplace_facets, marketplace_facets
+from .middleware import get_user_for_token, websocket_user_cache_key
+from .presence import LocalPresenceStore, PresenceTracker, RedisPresenceStore, presence
+from .serializers import MessageSerializer
+from .models import (
+    User, Post, PostLike, Comment, ChatRoom, Message, Connection, ConnectionRequest, MarketplaceItem
+)
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+class CampusTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_post(self, title='Hello', author=None):
+        return Post.objects.create(
+            author=author or self.user, title=title, content='Body', category=Post.CATEGORY_CHOICES[0][0]
+        )
+
+
+class PostFeedPaginationTests(CampusTestCase):
+    def test_cursor_walks_the_feed_without_gaps_or_repeats(self):
+        posts = [self.create_post(f'Post {i}') for i in range(5)]
+
+        seen = []
+        url = '/api/posts/?page_size=2&omit_comments=true'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [post['id'] for post in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(seen, [post.id for post in reversed(posts)])
+
+    def test_plain_request_still_returns_a_list(self):
+        self.create_post()
+        response = self.client.get('/api/posts/')
+        self.assertIsInstance(response.data, list)
+
+    def test_malformed_cursor_is_not_found(self):
+        for cursor in ['not-base64!', encode_cursor({'a': 1}), encode_cursor(['only one'])]:
+            response = self.client.get(f'/api/posts/?cursor={cursor}')
+            self.assertEqual(response.status_code, 404, cursor)
+
+    def test_cursor_values_of_the_wrong_type_are_not_found(self):
+        response = self.client.get(f"/api/posts/?cursor={encode_cursor(['abc', 'xyz'])}")
+        self.assertEqual(response.status_code, 404)
+
+
+class PostCounterTests(CampusTestCase):
+    def test_like_toggle_keeps_the_counter_in_step(self):
+        post = self.create_post()
+
+        response = self.client.post(f'/api/posts/{post.id}/like/')
+        self.assertEqual((response.data['liked'], response.data['likes_count']), (True, 1))
+        response = self.client.post(f'/api/posts/{post.id}/like/')
+        self.assertEqual((response.data['liked'], response.data['likes_count']), (False, 0))
+
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 0)
+
+    def test_counter_never_drops_below_zero(self):
+        post = self.create_post()
+        like = PostLike.objects.create(post=post, user=self.user)
+        Post.objects.filter(pk=post.pk).update(likes_count=0)
+
+        like.delete()
+
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, 0)
+
+    def test_comments_move_the_comment_counter(self):
+        post = self.create_post()
+        comment = Comment.objects.create(post=post, author=self.user, content='Nice')
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+
+    def test_reconcile_repairs_drifted_counters(self):
+        post = self.create_post()
+        PostLike.objects.create(post=post, user=self.user)
+        Post.objects.filter(pk=post.pk).update(likes_count=7, comments_count=3)
+
+        call_command('reconcile_post_counters', stdout=StringIO())
+
+        post.refresh_from_db()
+        self.assertEqual((post.likes_count, post.comments_count), (1, 0))
+
+
+class LikedByUserTests(CampusTestCase):
+    def feed_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/posts/?page_size=20')
+        return response, len(queries)
+
+    def test_liked_flag_is_resolved_per_page_in_one_query(self):
+        posts = [self.create_post(f'Post {i}') for i in range(2)]
+        PostLike.objects.create(post=posts[0], user=self.user)
+        response, small_page = self.feed_queries()
+
+        liked = {post['id']: post['is_liked_by_user'] for post in response.data['results']}
+        self.assertEqual(liked, {posts[0].id: True, posts[1].id: False})
+
+        for i in range(6):
+            PostLike.objects.create(post=self.create_post(f'More {i}'), user=self.user)
+        response, large_page = self.feed_queries()
+
+        self.assertEqual(len(response.data['results']), 8)
+        self.assertEqual(large_page, small_page)
+
+
+class ChatTestCase(CampusTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob = User.objects.create_user('bob', password='pass')
+        self.room = ChatRoom.objects.create(user1=self.user, user2=self.bob)
+
+
+class ChatInboxTests(ChatTestCase):
+    def inbox(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/chat/rooms/?view=inbox')
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_inbox_is_a_single_query_however_many_rooms(self):
+        self.room.add_message(self.bob, content='Hi alice')
+        _rooms, one_room = self.inbox()
+
+        for i in range(4):
+            other = User.objects.create_user(f'friend{i}', password='pass')
+            ChatRoom.objects.create(user1=self.user, user2=other).add_message(other, content='Hey')
+        rooms, five_rooms = self.inbox()
+
+        self.assertEqual(len(rooms), 5)
+        self.assertEqual(five_rooms, one_room)
+
+    def test_inbox_reports_the_callers_own_unread_count(self):
+        self.room.add_message(self.bob, content='One')
+        self.room.add_message(self.bob, content='Two')
+        self.room.add_message(self.user, content='Reply')
+
+        rooms, _queries = self.inbox()
+
+        self.assertEqual(rooms[0]['unread_count'], 2)
+        self.assertEqual(rooms[0]['last_message']['content'], 'Reply')
+
+
+class ChatRoomInboxStateTests(ChatTestCase):
+    def test_add_message_updates_last_message_and_recipient_counter(self):
+        message = self.room.add_message(self.bob, content='Hello there')
+
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_message_id, message.id)
+        self.assertEqual(self.room.last_message_preview, 'Hello there')
+        self.assertEqual((self.room.user1_unread_count, self.room.user2_unread_count), (1, 0))
+
+    def test_remove_message_repairs_pointer_and_counter(self):
+        first = self.room.add_message(self.bob, content='First')
+        second = self.room.add_message(self.bob, content='Second')
+        self.room.refresh_from_db()
+
+        self.room.remove_message(second)
+
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_message_id, first.id)
+        self.assertEqual(self.room.last_message_preview, 'First')
+        self.assertEqual(self.room.user1_unread_count, 1)
+
+
+class ChatHistoryPaginationTests(ChatTestCase):
+    def test_before_walks_back_through_history(self):
+        messages = [self.room.add_message(self.bob, content=f'm{i}') for i in range(5)]
+        url = f'/api/chat/{self.room.id}/messages/'
+
+        response = self.client.get(f'{url}?before=&page_size=2')
+        seen = [item['content'] for item in response.data['results']]
+        while response.data['has_more']:
+            response = self.client.get(f"{url}?before={response.data['oldest_id']}&page_size=2")
+            seen += [item['content'] for item in response.data['results']]
+
+        self.assertEqual(seen, [message.content for message in reversed(messages)])
+
+    def test_after_returns_newer_messages_newest_first(self):
+        messages = [self.room.add_message(self.bob, content=f'm{i}') for i in range(4)]
+
+        response = self.client.get(f'/api/chat/{self.room.id}/messages/?after={messages[1].id}')
+
+        self.assertEqual([item['content'] for item in response.data['results']], ['m3', 'm2'])
+
+    def test_unknown_anchor_is_not_found(self):
+        url = f'/api/chat/{self.room.id}/messages/'
+        self.assertEqual(self.client.get(f'{url}?before=not-a-uuid').status_code, 404)
+        self.assertEqual(self.client.get(f'{url}?before={self.room.id}').status_code, 404)
+
+
+class CompactMessageTests(ChatTestCase):
+    def test_compact_page_side_loads_each_sender_once(self):
+        for i in range(3):
+            self.room.add_message(self.bob, content=f'b{i}')
+            self.room.add_message(self.user, content=f'a{i}')
+
+        response = self.client.get(f'/api/chat/{self.room.id}/messages/?before=&compact=true')
+
+        results = response.data['results']
+        self.assertEqual(len(results), 6)
+        self.assertNotIn('sender', results[0])
+        self.assertEqual({item['sender_id'] for item in results}, {self.user.id, self.bob.id})
+        self.assertEqual(set(response.data['users']), {str(self.user.id), str(self.bob.id)})
+
+    def test_full_format_renders_every_declared_field(self):
+        self.room.add_message(self.bob, content='Hi')
+
+        response = self.client.get(f'/api/chat/{self.room.id}/messages/?before=')
+
+        self.assertEqual(set(response.data['results'][0]), set(MessageSerializer.Meta.fields))
+
+
+class WebsocketAuthTests(CampusTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_token_resolves_user_and_caches_no_password(self):
+        token = str(AccessToken.for_user(self.user))
+
+        user = async_to_sync(get_user_for_token)(token)
+
+        self.assertTrue(user.is_authenticated)
+        self.assertEqual((user.pk, user.username), (self.user.pk, 'alice'))
+        cached = cache.get(websocket_user_cache_key(self.user.pk))
+        self.assertNotIn('password', cached)
+        self.assertNotIn(self.user.password, repr(cached))
+
+    def test_cached_user_skips_the_database(self):
+        token = str(AccessToken.for_user(self.user))
+        async_to_sync(get_user_for_token)(token)
+
+        with self.assertNumQueries(0):
+            user = async_to_sync(get_user_for_token)(token)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_invalid_token_or_inactive_user_is_anonymous(self):
+        self.assertFalse(async_to_sync(get_user_for_token)('garbage').is_authenticated)
+
+        token = str(AccessToken.for_user(self.user))
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertFalse(async_to_sync(get_user_for_token)(token).is_authenticated)
+
+
+class WebsocketTestMixin:
+    """Websocket scenarios run as one coroutine, so every socket shares an event loop"""
+
+    async def open_socket(self, room, user):
+        communicator = WebsocketCommunicator(
+            application, f'/ws/chat/{room.id}/?token={AccessToken.for_user(user)}'
+        )
+        connected, _subprotocol = await communicator.connect()
+        return communicator, connected
+
+
+class ChatRoomAccessCacheTests(WebsocketTestMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_room_is_looked_up_once_per_socket(self):
+        async def scenario():
+            communicator, connected = await self.open_socket(self.room, self.user)
+            self.assertTrue(connected)
+            for i in range(3):
+                await communicator.send_json_to({'type': 'chat_message', 'content': f'Hi {i}'})
+                event = await communicator.receive_json_from()
+                self.assertEqual(event['message']['content'], f'Hi {i}')
+            await communicator.disconnect()
+
+        with CaptureQueriesContext(connection) as queries:
+            async_to_sync(scenario)()
+
+        room_lookups = [
+            query for query in queries
+            if query['sql'].startswith('SELECT') and 'FROM "campus_connect_chatroom"' in query['sql']
+        ]
+        # The access check at connect; the three messages reuse its result
+        self.assertEqual(len(room_lookups), 1)
+        self.assertEqual(self.room.messages.count(), 3)
+
+    def test_removing_the_connection_hangs_up_open_sockets(self):
+        connection_row = Connection.objects.create(user1=self.user, user2=self.bob)
+
+        def remove_connection():
+            with self.captureOnCommitCallbacks(execute=True):
+                connection_row.delete()
+
+        async def scenario():
+            communicator, connected = await self.open_socket(self.room, self.user)
+            self.assertTrue(connected)
+            await sync_to_async(remove_connection)()
+            while True:
+                output = await communicator.receive_output()
+                if output['type'] == 'websocket.close':
+                    break
+
+        async_to_sync(scenario)()
+
+    def test_outsider_is_refused(self):
+        outsider = User.objects.create_user('eve', password='pass')
+
+        async def scenario():
+            _communicator, connected = await self.open_socket(self.room, outsider)
+            return connected
+
+        self.assertFalse(async_to_sync(scenario)())
+
+
+class ShardedChannelLayerTests(WebsocketTestMixin, ChatTestCase):
+    """Chat on a two-host redis layer, each host a separate fake server"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.servers = [fakeredis.FakeServer(), fakeredis.FakeServer()]
+        self.config = {
+            'hosts': [{'connection_class': FakeConnection, 'server': server} for server in self.servers],
+            'prefix': 'campus',
+        }
+
+    def group_keys(self, server):
+        return {key.decode() for key in fakeredis.FakeRedis(server=server).keys('campus:group:*')}
+
+    def test_group_send_reaches_members_on_other_workers(self):
+        layer = RedisChannelLayer(**self.config)
+        # Two groups per host, whatever crc32 makes of the names
+        names = [f'chat_{i}' for i in range(100)]
+        groups = [name for name in names if layer.consistent_hash(name) == 0][:2]
+        groups += [name for name in names if layer.consistent_hash(name) == 1][:2]
+
+        async def scenario():
+            sender, receiver = RedisChannelLayer(**self.config), RedisChannelLayer(**self.config)
+            channels = {group: await receiver.new_channel() for group in groups}
+            for group, channel in channels.items():
+                await receiver.group_add(group, channel)
+            for group in groups:
+                await sender.group_send(group, {'type': 'chat.message', 'group': group})
+            received = [(await receiver.receive(channel))['group'] for channel in channels.values()]
+            group_keys = [self.group_keys(server) for server in self.servers]
+            await sender.flush()
+            await receiver.flush()
+            return received, group_keys
+
+        received, group_keys = async_to_sync(scenario)()
+
+        self.assertEqual(received, groups)
+        self.assertEqual(
+            group_keys,
+            [{f'campus:group:{group}' for group in groups[:2]}, {f'campus:group:{group}' for group in groups[2:]}]
+        )
+
+    def test_benchmark_fake_mode_runs_on_sharded_fakeredis(self):
+        out = StringIO()
+        call_command(
+            'benchmark_channel_layer', fake=True, shards=2, nodes=2, groups=8, messages=3, stdout=out
+        )
+
+        self.assertIn('fakeredis across 2 host(s)', out.getvalue())
+        self.assertIn('Groups per redis host', out.getvalue())
+        self.assertIn('All group messages delivered in order', out.getvalue())
+
+    def test_chat_is_delivered_over_the_sharded_layer(self):
+        async def scenario():
+            alice, alice_connected = await self.open_socket(self.room, self.user)
+            bob, bob_connected = await self.open_socket(self.room, self.bob)
+            self.assertTrue(alice_connected and bob_connected)
+            room_keys = [self.group_keys(server) for server in self.servers]
+
+            await alice.send_json_to({'type': 'chat_message', 'content': 'Over redis'})
+            while True:
+                event = await bob.receive_json_from()
+                if event.get('type') == 'chat_message':
+                    break
+            await alice.disconnect()
+            await bob.disconnect()
+            return event, room_keys
+
+        with override_settings(CHANNEL_LAYERS={
+            'default': {'BACKEND': 'channels_redis.core.RedisChannelLayer', 'CONFIG': self.config}
+        }):
+            event, room_keys = async_to_sync(scenario)()
+
+        self.assertEqual(event['message']['content'], 'Over redis')
+        room_group = f'campus:group:chat_{self.room.id}'
+        self.assertEqual(sum(room_group in keys for keys in room_keys), 1)
+
+
+class PresenceTrackerTestMixin:
+    """Runs against a store of each kind; subclasses provide make_store"""
+
+    def setUp(self):
+        super().setUp()
+        self.tracker = PresenceTracker()
+        self.tracker.ttl = 90
+        self.tracker._store = self.make_store()
+        self.now = 1_000_000.0
+        patcher = mock.patch('campus_connect.presence.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_user_is_online_while_any_socket_is(self):
+        self.assertTrue(self.tracker.connect(self.user.id, 'tab-1'))
+        self.assertFalse(self.tracker.connect(self.user.id, 'tab-2'))
+
+        self.assertFalse(self.tracker.disconnect(self.user.id, 'tab-1'))
+        self.assertTrue(self.tracker.is_online(self.user.id))
+        self.assertTrue(self.tracker.disconnect(self.user.id, 'tab-2'))
+        self.assertFalse(self.tracker.is_online(self.user.id))
+
+    def test_sweep_reports_lapsed_sockets_once(self):
+        self.tracker.connect(self.user.id, 'tab-1')
+        self.tracker.sweep()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_online)
+
+        self.now += 60
+        self.tracker.heartbeat(self.user.id, 'tab-1')
+        self.now += 60
+        self.assertEqual(self.tracker.sweep(), [])
+
+        self.now += 60
+        with self.assertNumQueries(1):
+            self.assertEqual(self.tracker.sweep(), [self.user.id])
+        self.assertEqual(self.tracker.sweep(), [])
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_online)
+
+    def test_clean_disconnect_is_not_reported_again_by_the_sweep(self):
+        self.tracker.connect(self.user.id, 'tab-1')
+        self.tracker.disconnect(self.user.id, 'tab-1')
+
+        self.now += 120
+        self.assertEqual(self.tracker.sweep(), [])
+
+    def test_heartbeat_after_the_sweep_brings_the_user_back(self):
+        self.tracker.connect(self.user.id, 'tab-1')
+        self.now += 120
+        self.tracker.sweep()
+
+        self.assertTrue(self.tracker.heartbeat(self.user.id, 'tab-1'))
+        self.assertFalse(self.tracker.heartbeat(self.user.id, 'tab-1'))
+
+    def test_sweep_writes_buffered_presence_in_one_update(self):
+        others = [User.objects.create_user(f'friend{i}', password='pass') for i in range(3)]
+        for other in others:
+            self.tracker.connect(other.id, f'tab-{other.id}')
+        self.tracker.disconnect(others[0].id, f'tab-{others[0].id}')
+
+        with self.assertNumQueries(1):
+            self.tracker.sweep()
+
+        states = dict(User.objects.filter(id__in=[other.id for other in others]).values_list('id', 'is_online'))
+        self.assertEqual(states, {others[0].id: False, others[1].id: True, others[2].id: True})
+
+
+class LocalPresenceTrackerTests(PresenceTrackerTestMixin, CampusTestCase):
+    def make_store(self):
+        return LocalPresenceStore()
+
+
+class RedisPresenceTrackerTests(PresenceTrackerTestMixin, CampusTestCase):
+    def make_store(self):
+        return RedisPresenceStore(fakeredis.FakeRedis())
+
+
+class PresenceBroadcastTests(WebsocketTestMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        Connection.objects.create(user1=self.user, user2=self.bob)
+        # Sockets other tests left open would count as already online
+        patcher = mock.patch.object(presence, '_store', LocalPresenceStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def next_presence(self, communicator):
+        while True:
+            event = await communicator.receive_json_from()
+            if event.get('type') == 'user_presence':
+                return event
+
+    def test_connections_see_the_user_come_and_go(self):
+        async def scenario():
+            bob, _connected = await self.open_socket(self.room, self.bob)
+            alice, _connected = await self.open_socket(self.room, self.user)
+            came = await self.next_presence(bob)
+            await alice.disconnect()
+            went = await self.next_presence(bob)
+            await bob.disconnect()
+            return came, went
+
+        came, went = async_to_sync(scenario)()
+
+        self.assertEqual((came['user_id'], came['is_online']), (self.user.id, True))
+        self.assertEqual((went['user_id'], went['is_online']), (self.user.id, False))
+
+
+class TypingIndicatorTests(WebsocketTestMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    async def open_pair(self):
+        alice, _connected = await self.open_socket(self.room, self.user)
+        bob, _connected = await self.open_socket(self.room, self.bob)
+        return alice, bob
+
+    def test_keystroke_frames_reach_peers_once(self):
+        async def scenario():
+            alice, bob = await self.open_pair()
+            for _keystroke in range(10):
+                await alice.send_json_to({'type': 'typing', 'is_typing': True})
+            first = await bob.receive_json_from()
+            repeats = not await bob.receive_nothing(timeout=0.2)
+
+            await alice.send_json_to({'type': 'chat_message', 'content': 'Done typing'})
+            stopped = await bob.receive_json_from()
+            message = await bob.receive_json_from()
+            await alice.disconnect()
+            await bob.disconnect()
+            return first, repeats, stopped, message
+
+        first, repeats, stopped, message = async_to_sync(scenario)()
+
+        self.assertEqual((first['type'], first['user'], first['is_typing']), ('typing_indicator', 'alice', True))
+        self.assertFalse(repeats)
+        self.assertEqual((stopped['type'], stopped['is_typing']), ('typing_indicator', False))
+        self.assertEqual(message['message']['content'], 'Done typing')
+
+    def test_typing_lapses_without_new_frames(self):
+        async def scenario():
+            alice, bob = await self.open_pair()
+            await alice.send_json_to({'type': 'typing', 'is_typing': True})
+            started = await bob.receive_json_from()
+            lapsed = await bob.receive_json_from(timeout=2)
+            await alice.disconnect()
+            await bob.disconnect()
+            return started, lapsed
+
+        with mock.patch.object(ChatConsumer, 'typing_timeout', 0.3):
+            started, lapsed = async_to_sync(scenario)()
+
+        self.assertTrue(started['is_typing'])
+        self.assertEqual((lapsed['type'], lapsed['is_typing']), ('typing_indicator', False))
+
+
+class MessageReceiptTests(WebsocketTestMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.messages = [self.room.add_message(self.bob, content=f'm{i}') for i in range(3)]
+
+    def test_delivery_is_one_update_and_only_moves_forward(self):
+        Message.objects.filter(pk=self.messages[0].pk).update(status='read')
+
+        with CaptureQueriesContext(connection) as queries:
+            updated = self.room.apply_receipt(self.user, 'delivered', message_ids=[m.id for m in self.messages])
+
+        self.assertEqual(updated, 2)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        statuses = dict(Message.objects.values_list('content', 'status'))
+        self.assertEqual(statuses, {'m0': 'read', 'm1': 'delivered', 'm2': 'delivered'})
+
+    def test_own_messages_are_not_receipted(self):
+        own = self.room.add_message(self.user, content='mine')
+
+        self.assertEqual(self.room.apply_receipt(self.user, 'delivered', message_ids=[own.id]), 0)
+
+    def test_a_batch_receipt_is_one_event_for_the_sender(self):
+        async def scenario():
+            alice, _connected = await self.open_socket(self.room, self.user)
+            bob, _connected = await self.open_socket(self.room, self.bob)
+            await alice.send_json_to({
+                'type': 'receipt', 'status': 'delivered',
+                'message_ids': [str(message.id) for message in self.messages]
+            })
+            event = await bob.receive_json_from()
+            extra = not await bob.receive_nothing(timeout=0.2)
+            await alice.send_json_to({'type': 'receipt', 'status': 'seen', 'message_ids': []})
+            error = await alice.receive_json_from()
+            await alice.disconnect()
+            await bob.disconnect()
+            return event, extra, error
+
+        event, extra, error = async_to_sync(scenario)()
+
+        self.assertEqual((event['type'], event['reader_id'], event['status']), ('message_receipt', self.user.id, 'delivered'))
+        self.assertEqual(sorted(event['message_ids']), sorted(str(message.id) for message in self.messages))
+        self.assertFalse(extra)
+        self.assertEqual(error, {'error': 'Invalid receipt status'})
+
+    def test_reading_ids_tells_the_sender_the_new_watermark(self):
+        async def scenario():
+            alice, _connected = await self.open_socket(self.room, self.user)
+            bob, _connected = await self.open_socket(self.room, self.bob)
+            await alice.send_json_to({
+                'type': 'receipt', 'status': 'read', 'message_ids': [str(self.messages[1].id)]
+            })
+            event = await bob.receive_json_from()
+            await alice.disconnect()
+            await bob.disconnect()
+            return event
+
+        event = async_to_sync(scenario)()
+
+        self.assertIsNone(event['message_ids'])
+        self.assertEqual(parse_datetime(event['up_to']), self.messages[1].created_at)
+        self.room.refresh_from_db()
+        read = [self.room.is_read_by_recipient(message) for message in self.messages]
+        self.assertEqual(read, [True, True, False])
+
+    def test_malformed_ids_are_rejected(self):
+        async def scenario():
+            alice, _connected = await self.open_socket(self.room, self.user)
+            bob, _connected = await self.open_socket(self.room, self.bob)
+            await alice.send_json_to({
+                'type': 'receipt', 'status': 'delivered',
+                'message_ids': [str(self.messages[0].id), 'not-a-uuid']
+            })
+            error = await alice.receive_json_from()
+            silent = await bob.receive_nothing(timeout=0.2)
+            await alice.disconnect()
+            await bob.disconnect()
+            return error, silent
+
+        error, silent = async_to_sync(scenario)()
+
+        self.assertEqual(error, {'error': 'Invalid message_ids'})
+        self.assertTrue(silent)
+        self.assertEqual(Message.objects.filter(status='delivered').count(), 0)
+
+
+class ReadCursorTests(ChatTestCase):
+    def history(self):
+        response = self.client.get(f'/api/chat/{self.room.id}/messages/?before=')
+        return {item['content']: item for item in response.data['results']}
+
+    def test_read_state_fields_agree_after_marking_read(self):
+        self.room.add_message(self.bob, content='read')
+        self.room.mark_read_by(self.user)
+        self.room.add_message(self.bob, content='unread')
+        self.room.refresh_from_db()
+
+        messages = self.history()
+
+        self.assertEqual((messages['read']['is_read'], messages['read']['status']), (True, 'read'))
+        self.assertEqual(
+            messages['read']['read_at'],
+            serializers.DateTimeField().to_representation(self.room.last_read_at_for(self.user.id))
+        )
+        self.assertEqual(
+            (messages['unread']['is_read'], messages['unread']['status'], messages['unread']['read_at']),
+            (False, 'sent', None)
+        )
+
+    def test_last_read_message_skips_the_readers_own_messages(self):
+        received = self.room.add_message(self.bob, content='From bob')
+        self.room.add_message(self.user, content='My reply')
+
+        self.room.mark_read_by(self.user)
+
+        self.room.refresh_from_db()
+        prefix = self.room.participant_prefix(self.user.id)
+        self.assertEqual(getattr(self.room, f'{prefix}_last_read_message_id'), received.id)
+        self.assertEqual(getattr(self.room, f'{prefix}_unread_count'), 0)
+
+
+class MessageSearchTests(ChatTestCase):
+    def search(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def contents(self, q):
+        return [item['content'] for item in self.search(f'/api/chat/search/?q={q}')['results']]
+
+    def test_index_follows_inserts_edits_and_deletes(self):
+        message = self.room.add_message(self.bob, content='Meet at the library')
+        self.assertEqual(self.contents('library'), ['Meet at the library'])
+
+        message.content = 'Meet at the cafeteria'
+        message.save()
+        self.assertEqual(self.contents('library'), [])
+        self.assertEqual(self.contents('cafeter'), ['Meet at the cafeteria'])
+
+        message.delete()
+        self.assertEqual(self.contents('cafeteria'), [])
+
+    def test_only_the_callers_rooms_are_searched(self):
+        eve = User.objects.create_user('eve', password='pass')
+        ChatRoom.objects.create(user1=self.bob, user2=eve).add_message(eve, content='Secret exam answers')
+        self.room.add_message(self.bob, content='Exam tomorrow')
+
+        self.assertEqual(self.contents('exam'), ['Exam tomorrow'])
+
+    def test_results_page_by_rank_without_repeats(self):
+        for i in range(5):
+            self.room.add_message(self.bob, content=f'Notes {i} ' + 'notes ' * i)
+
+        seen = []
+        url = '/api/chat/search/?q=notes&page_size=2'
+        while url:
+            page = self.search(url)
+            seen += [item['content'] for item in page['results']]
+            url = page['next']
+
+        # The more often a message says "notes", the higher it ranks
+        self.assertEqual(seen, [f'Notes {i} ' + 'notes ' * i for i in reversed(range(5))])
+
+    def test_query_without_words_matches_nothing(self):
+        self.room.add_message(self.bob, content='Hello')
+        self.assertEqual(self.contents('%22*'), [])
+
+    def test_index_survives_renumbered_rowids(self):
+        self.room.add_message(self.bob, content='Meet at the library')
+        self.room.add_message(self.bob, content='Bring the notes')
+
+        # What VACUUM may do to a table keyed on a UUID
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE campus_connect_message SET rowid = 1000 - rowid')
+
+        self.assertEqual(self.contents('library'), ['Meet at the library'])
+        self.assertEqual(self.contents('notes'), ['Bring the notes'])
+
+
+class CampusSearchTests(CampusTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = self.create_post('Chemistry study group')
+        self.item = MarketplaceItem.objects.create(
+            seller=self.user, title='Lab coat', description='Worn for one chemistry course',
+            price=10, category='Others'
+        )
+
+    def search(self, params):
+        response = self.client.get('/api/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_title_hits_rank_first_with_facets_per_type(self):
+        data = self.search({'q': 'chemistry'})
+
+        self.assertEqual(
+            [(hit['doc_type'], hit['object_id']) for hit in data['results']],
+            [('post', self.post.id), ('marketplace', self.item.id)]
+        )
+        self.assertEqual((data['facets']['post'], data['facets']['marketplace'], data['facets']['club']), (1, 1, 0))
+
+    def test_type_narrows_results_but_not_facets(self):
+        data = self.search({'q': 'chemistry', 'type': 'marketplace'})
+
+        self.assertEqual([hit['doc_type'] for hit in data['results']], ['marketplace'])
+        self.assertEqual(data['facets']['post'], 1)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'chemistry', 'type': 'bogus'}).status_code, 400)
+
+    def test_documents_follow_their_source_rows(self):
+        self.item.is_sold = True
+        self.item.save()
+        self.post.delete()
+
+        self.assertEqual(self.search({'q': 'chemistry'})['results'], [])
+
+
+class MarketplaceSortCursorTests(CampusTestCase):
+    def setUp(self):
+        super().setUp()
+        for price in (30, 10, 20, 40):
+            MarketplaceItem.objects.create(
+                seller=self.user, title=f'Item {price}', description='Desc', price=price, category='Others'
+            )
+
+    def walk(self, sort):
+        prices, url = [], f'/api/marketplace/?sort={sort}&page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            prices += [float(item['price']) for item in response.data['results']]
+            url = response.data['next']
+        return prices
+
+    def test_each_sort_pages_through_in_its_own_order(self):
+        self.assertEqual(self.walk('price_low'), [10, 20, 30, 40])
+        self.assertEqual(self.walk('price_high'), [40, 30, 20, 10])
+
+    def test_cursor_from_another_sort_is_rejected(self):
+        response = self.client.get('/api/marketplace/?sort=price_low&page_size=2')
+        cursor = response.data['next_cursor']
+
+        self.assertEqual(self.client.get(f'/api/marketplace/?sort=price_high&cursor={cursor}').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/marketplace/?sort=price_low&cursor={cursor}').status_code, 200)
+
+    def test_filters_narrow_the_browse_and_bad_values_are_rejected(self):
+        MarketplaceItem.objects.filter(price=20).update(category='Books')
+
+        response = self.client.get('/api/marketplace/?category=Books,Others&min_price=15&max_price=35&sort=price_low')
+        self.assertEqual([float(item['price']) for item in response.data], [20, 30])
+
+        for query in ['sort=cheapest', 'category=Cars', 'min_price=abc', 'max_price=-1', 'min_price=NaN']:
+            self.assertEqual(self.client.get(f'/api/marketplace/?{query}').status_code, 400, query)
+
+
+class FacetCacheTests(CampusTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def add_item(self, price=5):
+        with self.captureOnCommitCallbacks(execute=True):
+            return MarketplaceItem.objects.create(
+                seller=self.user, title='Item', description='Desc', price=price, category='Others'
+            )
+
+    def test_facets_are_cached_until_an_item_changes(self):
+        self.add_item()
+        self.assertEqual(self.client.get('/api/marketplace/facets/').data['total'], 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(marketplace_facets()['total'], 1)
+
+        item = self.add_item(price=60)
+        self.assertEqual(marketplace_facets()['total'], 2)
+
+        item.is_sold = True
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        self.assertEqual(marketplace_facets()['total'], 1)
+
+    def test_counts_computed_before_a_write_are_not_served_after_it(self):
+        def compute_then_write():
+            counts = compute_marketplace_facets()
+            self.add_item()
+            return counts
+
+        stale = cached_facets(MARKETPLACE_FACETS_KEY, compute_then_write)
+
+        self.assertEqual(stale['total'], 0)
+        self.assertEqual(marketplace_facets()['total'], 1)
+
+    def test_a_lost_generation_counter_does_not_revive_old_counts(self):
+        self.assertEqual(marketplace_facets()['total'], 0)
+        cache.delete(f'{MARKETPLACE_FACETS_KEY}:generation')
+        MarketplaceItem.objects.create(
+            seller=self.user, title='Item', description='Desc', price=5, category='Others'
+        )
+
+        self.assertEqual(marketplace_facets()['total'], 1)
+
+
+class StudentDiscoveryTests(CampusTestCase):
+    def setUp(self):
+        super().setUp()
+        self.friend = User.objects.create_user('friend', password='pass', course='Physics', year=2)
+        self.invited = User.objects.create_user('invited', password='pass', course='Biology', year=3)
+        self.stranger = User.objects.create_user('stranger', password='pass', course='Physics', year=3)
+        Connection.objects.create(user1=self.friend, user2=self.user)
+        ConnectionRequest.objects.create(sender=self.invited, receiver=self.user)
+
+    def usernames(self, q=''):
+        response = self.client.get('/api/students/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [student['username'] for student in response.data]
+
+    def test_connected_and_pending_students_are_left_out(self):
+        self.assertEqual(self.usernames(), ['stranger'])
+
+    def test_query_matches_name_course_or_year(self):
+        self.assertEqual(self.usernames('str'), ['stranger'])
+        self.assertEqual(self.usernames('phys'), ['stranger'])
+        self.assertEqual(self.usernames('3'), ['stranger'])
+        self.assertEqual(self.usernames('2'), [])
+
+    def test_odd_numeric_queries_do_not_fail(self):
+        for q in ['\u00b2', '9' * 30, '9' * 5000, '0']:
+            self.assertEqual(self.usernames(q), [], q)
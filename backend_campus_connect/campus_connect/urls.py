@@ -4,7 +4,7 @@ from .views import(
     ClubViewSet, EventViewSet,
     PostListCreateView, CommentCreateView, LikePostView, ReportPostView, #ConnectionViewSet,
     PostDetailView, LostAndFoundItemViewSet, MarketplaceItemListCreateView, MarketplaceItemDetailView,
-    mark_item_as_sold, CurrentUserView, search_messages
+    mark_item_as_sold, CurrentUserView, search_messages, campus_search
 )
 from . import views
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
@@ -36,6 +36,7 @@ urlpatterns = [
     path('posts/<int:pk>/comments/', CommentCreateView.as_view(), name='post-comments'),
     path('posts/<int:pk>/report/', ReportPostView.as_view(), name='post-report'),
     path('marketplace/', MarketplaceItemListCreateView.as_view(), name='marketplace-list'),
+    path('marketplace/facets/', views.marketplace_facets, name='marketplace-facets'),
     path('marketplace/<int:pk>/', MarketplaceItemDetailView.as_view(), name='marketplace-detail'),
     path('marketplace/<int:pk>/mark_sold/', mark_item_as_sold, name='marketplace-mark-sold'),
     
@@ -54,4 +55,5 @@ urlpatterns = [
     path('chat/<uuid:room_id>/mark-read/', views.mark_messages_read, name='mark_messages_read'),
     path('chat/message/<uuid:message_id>/delete/', views.delete_message, name='delete_message'),
     path('chat/search/', views.search_messages, name='search_message'),
+    path('search/', views.campus_search, name='campus_search'),
 ]
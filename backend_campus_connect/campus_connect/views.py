@@ -1,25 +1,32 @@
+from decimal import Decimal, InvalidOperation
 from django.shortcuts import get_object_or_404, render
 from django.db import models
 from rest_framework.pagination import PageNumberPagination
-from django.db.models import Q, Exists, OuterRef
+from django.db.models import Q, Exists, OuterRef, Prefetch
 from rest_framework import generics, permissions, viewsets, status
 from .models import( 
     User, Club, Event, Post, Comment, 
     PostLike, PostReport, LostAndFoundItem, 
     MarketplaceItem, Connection, ConnectionRequest 
-    , ChatRoom, Message
+    , ChatRoom, Message, SearchDocument
 )
 from .serializers import (
     UserSerializer, RegistrationSerializer, UserProfileSerializer,
     ClubSerializer, EventSerializer, PostSerializer, CommentSerializer,
     PostLikeSerializer, PostReportSerializer, LostAndFoundItemSerializer,
     MarketplaceItemSerializer, ConnectionSerializer, ConnectionRequestSerializer,
-    ChatRoomSerializer, MessageSerializer, UserDetailSerializer
+    ChatRoomSerializer, MessageSerializer, UserDetailSerializer,
+    ChatRoomInboxSerializer, MessageCompactSerializer, sideload_message_users,
+    SearchDocumentSerializer
 )
+from .pagination import PostFeedPagination, MarketplacePagination, StudentPagination, MessageKeysetPagination, SearchPagination
+from .facets import lost_found_facets, marketplace_facets as cached_marketplace_facets
+from .search import search_messages as search_message_index, search_documents, document_facets
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework.views import APIView
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -421,16 +428,52 @@ class CommentCreateView(generics.CreateAPIView):
         serializer.save(author=self.request.user, post=post)
 
 
+def get_liked_post_ids(user, posts=None):
+    """
+    Return the ids of `posts` liked by `user` as a set, using a single query.
+    With no posts given, every post the user has liked is returned.
+    """
+    if not user.is_authenticated:
+        return set()
+    likes = PostLike.objects.filter(user=user)
+    if posts is not None:
+        likes = likes.filter(post_id__in=[post.pk for post in posts])
+    return set(likes.values_list('post_id', flat=True))
+
+
 class PostListCreateView(APIView):
+    """
+    Home feed. Passing `cursor` or `page_size` switches to keyset pagination
+    over (created_at, id); `omit_comments=true` leaves the nested comments out.
+    """
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PostFeedPagination
 
     def get(self, request):
-        posts = Post.objects.all().order_by('-created_at')
-        serializer = PostSerializer(posts, many=True, context={'request': request})
+        omit_comments = request.query_params.get('omit_comments', '').lower() in ('1', 'true', 'yes')
+
+        posts = Post.objects.select_related('author').order_by('-created_at', '-id')
+        if not omit_comments:
+            posts = posts.prefetch_related(
+                Prefetch('comments', queryset=Comment.objects.select_related('author'))
+            )
+
+        context = {'request': request, 'omit_comments': omit_comments}
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(posts, request, view=self)
+
+        if page is not None:
+            context['liked_post_ids'] = get_liked_post_ids(request.user, page)
+            serializer = PostSerializer(page, many=True, context=context)
+            return paginator.get_paginated_response(serializer.data)
+
+        context['liked_post_ids'] = get_liked_post_ids(request.user)
+        serializer = PostSerializer(posts, many=True, context=context)
         return Response(serializer.data)
     
     def post(self, request):
-        serializer = PostSerializer(data=request.data, context={'request': request})
+        # A freshly created post cannot have been liked yet
+        serializer = PostSerializer(data=request.data, context={'request': request, 'liked_post_ids': set()})
         if serializer.is_valid():
             serializer.save(author=request.user)  
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -449,10 +492,11 @@ class LikePostView(APIView):
         else:
             liked = True
             
-        # Return the current like status and updated count
+        # The like signals have already moved the counter; re-read just that column
+        post.refresh_from_db(fields=['likes_count'])
         return Response({
             'liked': liked,
-            'likes_count': PostLike.objects.filter(post=post).count()
+            'likes_count': post.likes_count
         }, status=status.HTTP_200_OK)
 
 
@@ -471,11 +515,20 @@ class ReportPostView(generics.CreateAPIView):
     
     
 class PostDetailView(generics.RetrieveAPIView):
-    queryset = Post.objects.all()
+    queryset = Post.objects.select_related('author').prefetch_related(
+        Prefetch('comments', queryset=Comment.objects.select_related('author'))
+    )
     serializer_class = PostSerializer
     # permission_classes = [permissions.AllowAny]  # Or IsAuthenticated if needed
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]  
     lookup_field = 'pk'
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        context = self.get_serializer_context()
+        context['liked_post_ids'] = get_liked_post_ids(request.user, [instance])
+        serializer = self.get_serializer_class()(instance, context=context)
+        return Response(serializer.data)
     
     
     
@@ -486,14 +539,73 @@ class LostAndFoundItemViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Report counts per status, for the filter chips"""
+        return Response(lost_found_facets())
     
 
     
     
 class MarketplaceItemListCreateView(generics.ListCreateAPIView):
-    queryset = MarketplaceItem.objects.filter(is_sold=False).order_by('-created_at')
+    """
+    Unsold items, filtered by `category` and `condition` (comma separated),
+    `min_price` / `max_price`, and sorted by `sort` (newest, price_low or
+    price_high). Passing `cursor` or `page_size` switches to keyset
+    pagination in that sort order.
+    """
+    queryset = MarketplaceItem.objects.filter(is_sold=False).select_related('seller')
     serializer_class = MarketplaceItemSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = MarketplacePagination
+    sort_options = {
+        'newest': ('-created_at', '-id'),
+        'price_low': ('price', 'id'),
+        'price_high': ('-price', '-id'),
+    }
+
+    def get_ordering(self):
+        sort = self.request.query_params.get('sort') or 'newest'
+        if sort not in self.sort_options:
+            raise ValidationError({'sort': f"Choose from: {', '.join(self.sort_options)}"})
+        return self.sort_options[sort]
+
+    def get_choice_filter(self, param, choices):
+        values = [value for value in self.request.query_params.get(param, '').split(',') if value]
+        valid = [choice[0] for choice in choices]
+        invalid = [value for value in values if value not in valid]
+        if invalid:
+            raise ValidationError({param: f"Choose from: {', '.join(valid)}"})
+        return values
+
+    def get_price_filter(self, param):
+        value = self.request.query_params.get(param)
+        if not value:
+            return None
+        try:
+            price = Decimal(value)
+        except InvalidOperation:
+            raise ValidationError({param: 'Must be a number'})
+        if not price.is_finite() or price < 0:
+            raise ValidationError({param: 'Must be a non-negative number'})
+        return price
+
+    def get_queryset(self):
+        items = self.queryset
+        categories = self.get_choice_filter('category', MarketplaceItem.CATEGORY_CHOICES)
+        if categories:
+            items = items.filter(category__in=categories)
+        conditions = self.get_choice_filter('condition', MarketplaceItem.CONDITION_CHOICES)
+        if conditions:
+            items = items.filter(condition__in=conditions)
+        min_price = self.get_price_filter('min_price')
+        if min_price is not None:
+            items = items.filter(price__gte=min_price)
+        max_price = self.get_price_filter('max_price')
+        if max_price is not None:
+            items = items.filter(price__lte=max_price)
+        return items.order_by(*self.get_ordering())
 
     def perform_create(self, serializer):
         serializer.save(seller=self.request.user)
@@ -560,6 +672,13 @@ class MarketplaceItemDetailView(generics.RetrieveUpdateDestroyAPIView):
 
     
     
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticatedOrReadOnly])
+def marketplace_facets(request):
+    """Unsold item counts per category and price bucket, for the filter chips"""
+    return Response(cached_marketplace_facets())
+
+
 @api_view(['PATCH'])
 @permission_classes([permissions.IsAuthenticated])
 def mark_item_as_sold(request, pk):
@@ -600,39 +719,42 @@ class CurrentUserView(APIView):
 
 
 class StudentListView(generics.ListAPIView):
-    """List all students excluding current user and already connected users"""
+    """
+    List all students excluding current user, already connected users and
+    users with a pending request either way. `q` is a prefix match on
+    username or course, or the year of study when it is a number. Passing
+    `cursor` or `page_size` switches to keyset pagination by username.
+    """
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
-    
+    pagination_class = StudentPagination
+
     def get_queryset(self):
         current_user = self.request.user
-        
-        # Get users already connected to current user
-        connected_users = Connection.objects.filter(
-            Q(user1=current_user) | Q(user2=current_user)
-        ).values_list('user1', 'user2')
-        
-        connected_user_ids = set()
-        for user1_id, user2_id in connected_users:
-            connected_user_ids.add(user1_id)
-            connected_user_ids.add(user2_id)
-        
-        # Get users with pending requests (sent or received)
-        pending_requests = ConnectionRequest.objects.filter(
-            Q(sender=current_user) | Q(receiver=current_user),
-            status='pending'
-        ).values_list('sender', 'receiver')
-        
-        pending_user_ids = set()
-        for sender_id, receiver_id in pending_requests:
-            pending_user_ids.add(sender_id)
-            pending_user_ids.add(receiver_id)
-        
-        # Exclude current user, connected users, and users with pending requests
-        excluded_user_ids = connected_user_ids.union(pending_user_ids)
-        excluded_user_ids.add(current_user.id)
+        student = OuterRef('pk')
+
+        # NOT EXISTS anti-joins, each answered by the (user1, user2) /
+        # (sender, receiver) unique indexes, however many connections
+        # the user has
+        pending = ConnectionRequest.objects.filter(status='pending')
+        students = User.objects.exclude(pk=current_user.pk).filter(
+            ~Exists(Connection.objects.filter(user1=current_user, user2=student)),
+            ~Exists(Connection.objects.filter(user1=student, user2=current_user)),
+            ~Exists(pending.filter(sender=current_user, receiver=student)),
+            ~Exists(pending.filter(sender=student, receiver=current_user)),
+        )
+
+        query = self.request.query_params.get('q', '').strip()
+        if query:
+            matches = Q(username__istartswith=query) | Q(course__istartswith=query)
+            # isdecimal, not isdigit: '²' is a digit int() rejects. Years of
+            # study are 1-99, and checking the length first keeps huge
+            # numbers away from int() and the integer column
+            if query.isdecimal() and len(query) <= 2 and int(query) > 0:
+                matches |= Q(year=int(query))
+            students = students.filter(matches)
 
-        return User.objects.exclude(id__in=excluded_user_ids)
+        return students.order_by('username', 'id')
 
 
 @api_view(['POST'])
@@ -825,10 +947,18 @@ def get_or_create_chat_room(request, user_id):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def my_chat_rooms(request):
-    """Get all chat rooms for current user"""
+    """
+    Get all chat rooms for current user.
+    `view=inbox` returns the compact inbox built from a single annotated query.
+    """
+    if request.query_params.get('view') == 'inbox':
+        chat_rooms = ChatRoom.objects.inbox(request.user)
+        serializer = ChatRoomInboxSerializer(chat_rooms, many=True, context={'request': request})
+        return Response(serializer.data)
+
     chat_rooms = ChatRoom.objects.filter(
         Q(user1=request.user) | Q(user2=request.user)
-    ).order_by('-updated_at')
+    ).select_related('user1', 'user2', 'last_message__sender').order_by('-updated_at')
     
     serializer = ChatRoomSerializer(chat_rooms, many=True, context={'request': request})
     return Response(serializer.data)
@@ -836,7 +966,12 @@ def my_chat_rooms(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def chat_messages(request, room_id):
-    """Get messages for a specific chat room"""
+    """
+    Get messages for a specific chat room.
+    `before`/`after` message ids switch to keyset pagination; `page` keeps
+    the old page-number behaviour. `compact=true` sends sender ids only, with
+    the participants of the page side-loaded once under `users`.
+    """
     try:
         chat_room = ChatRoom.objects.get(
             Q(user1=request.user) | Q(user2=request.user),
@@ -845,15 +980,30 @@ def chat_messages(request, room_id):
     except ChatRoom.DoesNotExist:
         return Response({'error': 'Chat room not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    messages = chat_room.messages.all()
-    paginator = MessagePagination()
+    compact = request.query_params.get('compact', '').lower() in ('1', 'true', 'yes')
+    if compact:
+        messages = chat_room.messages.all()
+        serializer_class = MessageCompactSerializer
+    else:
+        messages = chat_room.messages.select_related('sender')
+        serializer_class = MessageSerializer
+
+    paginator = MessageKeysetPagination()
     page = paginator.paginate_queryset(messages, request)
+    if page is None:
+        paginator = MessagePagination()
+        page = paginator.paginate_queryset(messages, request)
     
+    # Read state is derived from this room's read cursors
+    context = {'request': request, 'chat_room': chat_room}
     if page is not None:
-        serializer = MessageSerializer(page, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        serializer = serializer_class(page, many=True, context=context)
+        response = paginator.get_paginated_response(serializer.data)
+        if compact:
+            response.data['users'] = sideload_message_users(page, context={'request': request})
+        return response
     
-    serializer = MessageSerializer(messages, many=True)
+    serializer = serializer_class(messages, many=True, context=context)
     return Response(serializer.data)
 
 @api_view(['POST'])
@@ -880,17 +1030,14 @@ def send_message(request, room_id):
         return Response({'error': 'File is required for this message type'}, 
                        status=status.HTTP_400_BAD_REQUEST)
     
-    message = Message.objects.create(
-        chat_room=chat_room,
-        sender=request.user,
+    # Inserts the message and updates the room's inbox state in one transaction
+    message = chat_room.add_message(
+        request.user,
         message_type=message_type,
         content=content,
         file=file
     )
     
-    # Update chat room timestamp
-    chat_room.save()
-    
     serializer = MessageSerializer(message)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -906,11 +1053,10 @@ def mark_messages_read(request, room_id):
     except ChatRoom.DoesNotExist:
         return Response({'error': 'Chat room not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    # Mark all unread messages from other user as read
-    updated_count = Message.objects.filter(
-        chat_room=chat_room,
-        is_read=False
-    ).exclude(sender=request.user).update(is_read=True)
+    # Mark all unread messages from other user as read; a single write to
+    # the room's read cursor, however long the backlog
+    updated_count = chat_room.unread_count_for(request.user)
+    chat_room.mark_read_by(request.user)
     
     return Response({'message': f'{updated_count} messages marked as read'})
 
@@ -919,20 +1065,62 @@ def mark_messages_read(request, room_id):
 def delete_message(request, message_id):
     """Delete a message (only sender can delete)"""
     try:
-        message = Message.objects.get(
+        message = Message.objects.select_related('chat_room').get(
             id=message_id,
             sender=request.user
         )
-        message.delete()
+        message.chat_room.remove_message(message)
         return Response({'message': 'Message deleted'})
     except Message.DoesNotExist:
         return Response({'error': 'Message not found'}, status=status.HTTP_404_NOT_FOUND)
 
 @api_view(['GET'])
+@permission_classes([IsAuthenticated])
 def search_messages(request):
-    query = request.GET.get('q', '')
-    messages = Message.objects.filter(
-        chat_room__in=user_chat_rooms,
-        content__icontains=query
+    """
+    Full-text search over the messages in the caller's chat rooms, best
+    match first, served from the message search index (see search.py).
+    Pages are cursor based: follow `next` / pass `cursor`.
+    """
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return Response({'error': 'Search query is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    messages = search_message_index(request.user, query).select_related('sender', 'chat_room')
+    paginator = SearchPagination()
+    page = paginator.paginate_queryset(messages, request)
+    serializer = MessageSerializer(page, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def campus_search(request):
+    """
+    One ranked search across posts, marketplace items, lost & found
+    reports, clubs and events, title matches first. `type` narrows the
+    results to a comma separated list of document types; the first page
+    also carries `facets`, the number of matches per type.
+    """
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return Response({'error': 'Search query is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    doc_types = [doc_type for doc_type in request.GET.get('type', '').split(',') if doc_type]
+    valid_types = {doc_type for doc_type, _label in SearchDocument.DOC_TYPES}
+    if not set(doc_types) <= valid_types:
+        return Response(
+            {'error': f"type must be one of: {', '.join(sorted(valid_types))}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    matches = search_documents(query)
+    documents = matches.filter(doc_type__in=doc_types) if doc_types else matches
+    paginator = SearchPagination()
+    page = paginator.paginate_queryset(documents, request)
+    response = paginator.get_paginated_response(
+        SearchDocumentSerializer(page, many=True).data
     )
-    return Response(MessageSerializer(messages, many=True).data)
\ No newline at end of file
+    if paginator.cursor_query_param not in request.query_params:
+        response.data['facets'] = document_facets(matches)
+    return response
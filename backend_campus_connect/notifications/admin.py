@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import NotificationDevice, Notification
+from .models import NotificationDevice, Notification, PushOutbox
 
 
 admin.site.register(NotificationDevice)
-admin.site.register(Notification)
\ No newline at end of file
+admin.site.register(Notification)
+admin.site.register(PushOutbox)
@@ -0,0 +1,48 @@
+"""
+Minimal stand-in for the FCM legacy HTTP endpoint, for benchmarking push
+delivery offline. Tokens starting with 'dead' are answered as
+NotRegistered, everything else succeeds after an optional delay.
+"""
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubFCMHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; avoid delayed-ACK stalls
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if str(body.get('to', '')).startswith('dead'):
+            result = {'success': 0, 'failure': 1, 'results': [{'error': 'NotRegistered'}]}
+        else:
+            result = {'success': 1, 'failure': 0, 'results': [{'message_id': str(uuid.uuid4())}]}
+
+        data = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.requests_served += 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_stub_server(host='127.0.0.1', port=0, latency=0.0):
+    """Create (but do not start) a stub server; port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), StubFCMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.requests_served = 0
+    return server
@@ -0,0 +1,52 @@
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from notifications.fcm_stub import make_stub_server
+from notifications.push import PushDispatcher
+
+
+class Command(BaseCommand):
+    help = "Measure push dispatcher throughput against the stub FCM server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=settings.PUSH_MAX_CONCURRENCY)
+        parser.add_argument('--latency-ms', type=float, default=50,
+                            help='Simulated FCM latency when using the built-in stub')
+        parser.add_argument('--dead-ratio', type=float, default=0.0,
+                            help='Fraction of tokens the stub reports as NotRegistered')
+        parser.add_argument('--url', help='Use an already running endpoint instead of the built-in stub')
+
+    def handle(self, *args, **options):
+        server = None
+        url = options['url']
+        if not url:
+            server = make_stub_server(latency=options['latency_ms'] / 1000)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            host, port = server.server_address
+            url = f'http://{host}:{port}/fcm/send'
+
+        count = options['messages']
+        dead_every = int(1 / options['dead_ratio']) if options['dead_ratio'] > 0 else 0
+        payload = {"notification": {"title": "Benchmark", "body": "Hello"}, "data": {}}
+        messages = [
+            (i, f"{'dead' if dead_every and i % dead_every == 0 else 'token'}-{i}", payload)
+            for i in range(count)
+        ]
+
+        dispatcher = PushDispatcher('benchmark', url, max_concurrency=options['concurrency'])
+        started = time.perf_counter()
+        result = dispatcher.dispatch(messages)
+        elapsed = time.perf_counter() - started
+        dispatcher.executor.shutdown()
+
+        if server:
+            server.shutdown()
+            server.server_close()
+
+        self.stdout.write(
+            f"{count} messages in {elapsed:.2f}s ({count / elapsed:.0f} msg/s) with concurrency "
+            f"{options['concurrency']}: {len(result.sent)} sent, {len(result.dead)} dead, "
+            f"{len(result.failed)} failed"
+        )
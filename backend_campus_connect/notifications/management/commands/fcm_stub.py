@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from notifications.fcm_stub import make_stub_server
+
+
+class Command(BaseCommand):
+    help = "Run a local stub of the FCM send endpoint (set FCM_URL to point at it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=9099)
+        parser.add_argument('--latency-ms', type=float, default=50,
+                            help='Simulated per-request latency')
+
+    def handle(self, *args, **options):
+        server = make_stub_server(options['host'], options['port'], options['latency_ms'] / 1000)
+        host, port = server.server_address
+        self.stdout.write(f'Stub FCM listening on http://{host}:{port}/fcm/send')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from campus_connect.models import User
+from notifications.models import Notification, NotificationCounter
+
+
+class Command(BaseCommand):
+    help = "Recompute NotificationCounter.unread_count from the Notification table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='user_ids',
+            help='Only reconcile the given user id (may be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['user_ids']:
+            users = users.filter(pk__in=options['user_ids'])
+
+        # Make sure everyone with notifications has a counter row to update
+        missing = users.filter(notification_counter__isnull=True, notifications__isnull=False).distinct()
+        NotificationCounter.objects.bulk_create(
+            [NotificationCounter(user_id=user_id) for user_id in missing.values_list('pk', flat=True)],
+            ignore_conflicts=True,
+        )
+
+        unread = (
+            Notification.objects.filter(recipient=OuterRef('user'), is_read=False)
+            .order_by()
+            .values('recipient')
+            .annotate(total=Count('pk'))
+            .values('total')
+        )
+        counters = NotificationCounter.objects.all()
+        if options['user_ids']:
+            counters = counters.filter(user_id__in=options['user_ids'])
+
+        # One UPDATE ... SET unread_count = (SELECT COUNT(*) ...) for all counters
+        updated = counters.update(
+            unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0))
+        )
+        self.stdout.write(self.style.SUCCESS(f'Reconciled unread counters for {updated} users'))
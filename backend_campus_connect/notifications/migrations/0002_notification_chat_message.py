@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0001_initial"),
+    ]
+
+    operations = [
+        # The chat message FK keeps its message_id column; only the field
+        # name changes, freeing `message` for the notification text.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameField(
+                    model_name="notification",
+                    old_name="message",
+                    new_name="chat_message",
+                ),
+                migrations.AlterField(
+                    model_name="notification",
+                    name="chat_message",
+                    field=models.ForeignKey(
+                        blank=True,
+                        db_column="message_id",
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="campus_connect.message",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="message",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_notification_counters(apps, schema_editor):
+    Notification = apps.get_model("notifications", "Notification")
+    NotificationCounter = apps.get_model("notifications", "NotificationCounter")
+
+    unread = (
+        Notification.objects.filter(is_read=False)
+        .order_by()
+        .values("recipient")
+        .annotate(total=Count("pk"))
+        .values_list("recipient", "total")
+    )
+    NotificationCounter.objects.bulk_create(
+        [
+            NotificationCounter(user_id=user_id, unread_count=total)
+            for user_id, total in unread.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("campus_connect", "0008_chatroom_inbox_state"),
+        ("notifications", "0003_push_outbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationCounter",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="notification_counter",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("unread_count", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_notification_counters, migrations.RunPython.noop),
+    ]
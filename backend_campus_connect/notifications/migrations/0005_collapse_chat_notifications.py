@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("campus_connect", "0008_chatroom_inbox_state"),
+        ("notifications", "0004_notification_counter"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="chat_room",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="campus_connect.chatroom",
+            ),
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="message_count",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddConstraint(
+            model_name="notification",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("is_read", False), ("notification_type", "new_message")
+                ),
+                fields=("recipient", "chat_room"),
+                name="unique_unread_chat_notification",
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:38
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def drop_duplicate_pending_pushes(apps, schema_editor):
+    """Keep the oldest pending row of each notification; it sends the latest content anyway"""
+    PushOutbox = apps.get_model("notifications", "PushOutbox")
+
+    pending = PushOutbox.objects.filter(status="pending")
+    keep = (
+        pending.order_by()
+        .values("notification")
+        .annotate(first_id=Min("id"))
+        .values("first_id")
+    )
+    pending.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0005_collapse_chat_notifications"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_pending_pushes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="pushoutbox",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status", "pending")),
+                fields=("notification",),
+                name="unique_pending_push",
+            ),
+        ),
+    ]
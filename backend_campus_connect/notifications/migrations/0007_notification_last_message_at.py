@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0006_unique_pending_push"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,7 +1,9 @@
 from django.db import models
 import uuid
-from django.db import models
-from campus_connect.models import User, MarketplaceItem, LostAndFoundItem, ConnectionRequest, Message
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from campus_connect.models import User, MarketplaceItem, LostAndFoundItem, ConnectionRequest, Message, ChatRoom
 from django.utils import timezone
 
 class NotificationDevice(models.Model):
@@ -41,7 +43,7 @@ class Notification(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_notifications', null=True, blank=True)
     notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPES)
     title = models.CharField(max_length=100)
-    message = models.TextField()
+    message = models.TextField(blank=True, default='')
     data = models.JSONField(default=dict, blank=True)  # Additional data like item_id, etc.
     is_read = models.BooleanField(default=False)
     is_sent = models.BooleanField(default=False)  # Whether push notification was sent
@@ -52,7 +54,15 @@ class Notification(models.Model):
     marketplace_item = models.ForeignKey(MarketplaceItem, on_delete=models.CASCADE, null=True, blank=True)
     lost_found_item = models.ForeignKey(LostAndFoundItem, on_delete=models.CASCADE, null=True, blank=True)
     connection_request = models.ForeignKey(ConnectionRequest, on_delete=models.CASCADE, null=True, blank=True)
-    message = models.ForeignKey(Message, on_delete=models.CASCADE, null=True, blank=True)
+    # Named chat_message so it does not shadow the `message` text above;
+    # the column is still message_id
+    chat_message = models.ForeignKey(Message, on_delete=models.CASCADE, null=True, blank=True, db_column='message_id')
+    # Chat notifications collapse per conversation: while unread, the one
+    # row is updated with the latest message and a running count; it keeps
+    # the created_at and chat_message of the message that opened it
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, null=True, blank=True)
+    message_count = models.PositiveIntegerField(default=1)
+    last_message_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
@@ -61,13 +71,111 @@ class Notification(models.Model):
             models.Index(fields=['recipient', 'is_read']),
             models.Index(fields=['notification_type', '-created_at']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient', 'chat_room'],
+                condition=models.Q(notification_type='new_message', is_read=False),
+                name='unique_unread_chat_notification',
+            ),
+        ]
     
     def mark_as_read(self):
         if not self.is_read:
             self.is_read = True
             self.read_at = timezone.now()
-            self.save(update_fields=['is_read', 'read_at'])
+            with transaction.atomic():
+                # Conditional UPDATE so a concurrent read never decrements twice
+                updated = Notification.objects.filter(pk=self.pk, is_read=False).update(
+                    is_read=True, read_at=self.read_at
+                )
+                if updated:
+                    NotificationCounter.decrement(self.recipient_id)
     
     def __str__(self):
         return f"{self.title} -> {self.recipient.username}"
 
+
+class PushOutbox(models.Model):
+    """
+    Push delivery owed for a notification.
+
+    Rows are written in the same transaction as the notification itself, so
+    a push can never be lost between the commit and the broker; a worker
+    drains due rows, retrying with backoff and dead-lettering after
+    PUSH_MAX_ATTEMPTS.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_DEAD, 'Dead'),
+    ]
+
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='push_outbox')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['next_attempt_at']
+        indexes = [
+            # Only pending rows are ever scanned by the worker
+            models.Index(
+                fields=['next_attempt_at'],
+                condition=models.Q(status='pending'),
+                name='push_outbox_due_idx',
+            ),
+        ]
+        constraints = [
+            # One push owed per notification at a time, however often it is enqueued
+            models.UniqueConstraint(
+                fields=['notification'],
+                condition=models.Q(status='pending'),
+                name='unique_pending_push',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.notification_id} [{self.status}]"
+
+
+class NotificationCounter(models.Model):
+    """
+    Denormalized unread-notification count per user, used for the badge.
+
+    Kept in step with Notification inserts and reads through F() updates so
+    reading it is a primary-key lookup; `reconcile_notification_counters`
+    recomputes it from the source rows periodically.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread_count = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def increment(cls, user_ids):
+        """Add one unread notification for each of the given users"""
+        user_ids = list(user_ids)
+        cls.objects.bulk_create([cls(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+        cls.objects.filter(user_id__in=user_ids).update(unread_count=F('unread_count') + 1)
+
+    @classmethod
+    def decrement(cls, user_id, by=1):
+        """Remove `by` unread notifications for one user, never going below zero"""
+        if by > 0:
+            cls.objects.filter(user_id=user_id).update(
+                unread_count=Greatest(F('unread_count') - by, Value(0))
+            )
+
+    @classmethod
+    def counts_for(cls, user_ids):
+        """{user_id: unread_count} for the given users in a single query"""
+        counts = dict.fromkeys(user_ids, 0)
+        counts.update(cls.objects.filter(user_id__in=counts).values_list('user_id', 'unread_count'))
+        return counts
+
+    def __str__(self):
+        return f"{self.user_id}: {self.unread_count} unread"
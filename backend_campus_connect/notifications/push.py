@@ -0,0 +1,99 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# FCM errors meaning the token will never work again
+DEAD_TOKEN_ERRORS = {'NotRegistered', 'InvalidRegistration', 'MismatchSenderId'}
+
+
+@dataclass
+class PushResult:
+    """Outcome of a dispatch, keyed by whatever id the caller attached to each message"""
+    sent: List = field(default_factory=list)
+    dead: List = field(default_factory=list)
+    failed: List = field(default_factory=list)
+
+
+class PushDispatcher:
+    """
+    Send FCM messages concurrently over a shared keep-alive session.
+
+    The HTTP connection pool and the worker threads are both capped at
+    `max_concurrency`, so TLS handshakes are paid once per pooled connection
+    instead of once per device and at most that many requests are in flight.
+    """
+
+    def __init__(self, server_key: str, url: str, max_concurrency: int = 20, timeout: float = 10):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "Authorization": f"key={server_key}",
+            "Content-Type": "application/json"
+        })
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='push')
+
+    def send(self, token: str, payload: dict) -> str:
+        """Send one message; returns 'sent', 'dead' or 'failed'"""
+        try:
+            response = self.session.post(
+                self.url,
+                data=json.dumps({**payload, "to": token}),
+                timeout=self.timeout
+            )
+            if response.status_code != 200:
+                logger.error(f"Push request returned HTTP {response.status_code}")
+                return 'failed'
+            result = response.json()
+        except ValueError:
+            # A proxy or FCM outage page rather than an FCM response; retry later
+            logger.error("Push request returned a non-JSON body")
+            return 'failed'
+        except requests.RequestException as e:
+            logger.error(f"Push request failed: {e}")
+            return 'failed'
+
+        if result.get('success', 0) > 0:
+            return 'sent'
+        if result.get('failure', 0) > 0:
+            # Transient errors such as 'Unavailable' keep the token alive
+            errors = {item.get('error') for item in result.get('results', [])} - {None}
+            if not errors or errors & DEAD_TOKEN_ERRORS:
+                return 'dead'
+        return 'failed'
+
+    def dispatch(self, messages: List[Tuple[object, str, dict]]) -> PushResult:
+        """Send (key, token, payload) messages concurrently and group the keys by outcome"""
+        result = PushResult()
+        outcomes = self.executor.map(lambda message: self.send(message[1], message[2]), messages)
+        for (key, _token, _payload), outcome in zip(messages, outcomes):
+            getattr(result, outcome).append(key)
+        return result
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> PushDispatcher:
+    """Process-wide dispatcher, so pooled connections survive across tasks"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = PushDispatcher(
+                server_key=settings.FCM_SERVER_KEY,
+                url=settings.FCM_URL,
+                max_concurrency=settings.PUSH_MAX_CONCURRENCY,
+            )
+        return _dispatcher
@@ -52,6 +52,8 @@ class NotificationSerializer(serializers.ModelSerializer):
             'created_at',
             'read_at',
             'time_since_created',
+            'message_count',
+            'last_message_at',
             # Optional related fields
             'marketplace_item_title',
             'lost_found_item_title',
@@ -113,7 +115,10 @@ class NotificationDetailSerializer(serializers.ModelSerializer):
             'marketplace_item',
             'lost_found_item',
             'connection_request',
-            'message',
+            'chat_message',
+            'chat_room',
+            'message_count',
+            'last_message_at',
         ]
         read_only_fields = [
             'id', 
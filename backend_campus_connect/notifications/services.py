@@ -1,13 +1,16 @@
 
-import json
-import requests
 from django.conf import settings
 # from django.contrib.auth.models import User
 from campus_connect.models import User
-from django.db import transaction
-from typing import List, Dict, Optional
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from datetime import timedelta
+from typing import List, Dict, Optional, Iterable
+from itertools import islice
 import logging
-from .models import Notification, NotificationDevice
+from .models import Notification, NotificationCounter, NotificationDevice, PushOutbox
+from .push import get_dispatcher
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +19,13 @@ class NotificationService:
     
     def __init__(self):
         self.fcm_server_key = getattr(settings, 'FCM_SERVER_KEY', None)
-        self.fcm_url = "https://fcm.googleapis.com/fcm/send"
+        self.fanout_batch_size = getattr(settings, 'NOTIFICATION_FANOUT_BATCH_SIZE', 1000)
+        self.outbox_batch_size = getattr(settings, 'PUSH_OUTBOX_BATCH_SIZE', 500)
+        self.max_attempts = getattr(settings, 'PUSH_MAX_ATTEMPTS', 8)
+        self.retry_base_delay = getattr(settings, 'PUSH_RETRY_BASE_DELAY', 30)
+        self.retry_max_delay = getattr(settings, 'PUSH_RETRY_MAX_DELAY', 3600)
+        self.outbox_lease = getattr(settings, 'PUSH_OUTBOX_LEASE', 300)
+        self.collapse_interval = getattr(settings, 'PUSH_COLLAPSE_INTERVAL', 30)
     
     def create_notification(self, 
                           recipient: User, 
@@ -30,86 +39,246 @@ class NotificationService:
         
         notification_data = data or {}
         
-        notification = Notification.objects.create(
-            recipient=recipient,
-            sender=sender,
-            notification_type=notification_type,
-            title=title,
-            message=message,
-            data=notification_data,
-            **related_objects
-        )
-        
-        # Send push notification asynchronously
-        self.send_push_notification(notification)
+        with transaction.atomic():
+            notification = Notification.objects.create(
+                recipient=recipient,
+                sender=sender,
+                notification_type=notification_type,
+                title=title,
+                message=message,
+                data=notification_data,
+                **related_objects
+            )
+            NotificationCounter.increment([recipient.id])
+            # Push delivery is recorded alongside the row and drained by a worker
+            self.enqueue_push([notification.id])
         
         return notification
+
+    def bulk_notify(self,
+                    recipient_ids: Iterable[int],
+                    notification_type: str,
+                    title: str,
+                    message: str,
+                    sender: User = None,
+                    data: Dict = None,
+                    **related_objects) -> int:
+        """
+        Create the same notification for many recipients.
+
+        Rows are written with one bulk_create per batch, together with the
+        batch's push outbox rows, so the cost on the caller is a handful of
+        INSERTs rather than one round trip per user.
+        """
+        notification_data = data or {}
+        recipient_ids = iter(recipient_ids)
+        total = 0
+
+        while True:
+            batch = list(islice(recipient_ids, self.fanout_batch_size))
+            if not batch:
+                break
+
+            notifications = [
+                Notification(
+                    recipient_id=recipient_id,
+                    sender=sender,
+                    notification_type=notification_type,
+                    title=title,
+                    message=message,
+                    data=notification_data,
+                    **related_objects
+                )
+                for recipient_id in batch
+            ]
+            with transaction.atomic():
+                Notification.objects.bulk_create(notifications)
+                NotificationCounter.increment(batch)
+                self.enqueue_push([notification.id for notification in notifications])
+            total += len(notifications)
+
+        return total
+
+    def enqueue_push(self, notification_ids: List, delay: int = 0):
+        """
+        Record push delivery for the given notifications in the outbox.
+
+        Must run inside the transaction that created the notifications. A
+        notification has at most one pending row (see PushOutbox), so
+        enqueueing one that is already waiting is a no-op: the pending push
+        goes out with the notification's latest content. The rows are sent
+        by the worker, kicked after the commit when a broker is configured
+        and by the periodic drain otherwise; with a `delay` they are left
+        for the periodic drain to send later.
+        """
+        from .tasks import drain_push_outbox
+
+        next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        PushOutbox.objects.bulk_create([
+            PushOutbox(notification_id=notification_id, next_attempt_at=next_attempt_at)
+            for notification_id in notification_ids
+        ], ignore_conflicts=True)
+        if not delay and not settings.CELERY_TASK_ALWAYS_EAGER:
+            # An eager task would make the FCM calls inside the caller's request
+            transaction.on_commit(drain_push_outbox.delay)
+
+    def claim_outbox_batch(self) -> List[int]:
+        """
+        Lease a batch of due outbox rows to this worker.
+
+        Rows are locked with SKIP LOCKED so concurrent workers never claim
+        the same entries, and the lease pushes next_attempt_at forward so a
+        worker that dies mid-batch only delays those pushes. The lock is held
+        for this short transaction only, never across the network calls.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            ids = list(
+                PushOutbox.objects.select_for_update(skip_locked=True)
+                .filter(status=PushOutbox.STATUS_PENDING, next_attempt_at__lte=now)
+                .order_by('next_attempt_at')
+                .values_list('id', flat=True)[:self.outbox_batch_size]
+            )
+            if ids:
+                PushOutbox.objects.filter(id__in=ids).update(
+                    attempts=F('attempts') + 1,
+                    next_attempt_at=now + timedelta(seconds=self.outbox_lease)
+                )
+        return ids
+
+    def retry_delay(self, attempts: int) -> timedelta:
+        """Exponential backoff: base, 2x base, 4x base ... capped at the max delay"""
+        delay = self.retry_base_delay * (2 ** max(attempts - 1, 0))
+        return timedelta(seconds=min(delay, self.retry_max_delay))
+
+    def drain_outbox_batch(self) -> int:
+        """
+        Deliver one leased batch from the outbox and record the outcome.
+
+        Delivery is idempotent per notification: anything already marked
+        is_sent (say, by a worker that died before closing its outbox row)
+        is closed without pushing again. Returns the number of rows claimed.
+        """
+        if not self.fcm_server_key:
+            # Leave rows pending until push is configured rather than burning attempts
+            logger.warning("FCM_SERVER_KEY not configured")
+            return 0
+
+        ids = self.claim_outbox_batch()
+        if not ids:
+            return 0
+
+        entries = list(PushOutbox.objects.filter(id__in=ids).select_related('notification'))
+        pending = [entry.notification for entry in entries if not entry.notification.is_sent]
+        outcomes = self.send_push_batch(pending) if pending else {}
+
+        now = timezone.now()
+        done, dead = [], []
+        retries = {}
+        for entry in entries:
+            if outcomes.get(entry.notification_id, 'sent') != 'failed':
+                done.append(entry.id)
+            elif entry.attempts >= self.max_attempts:
+                dead.append(entry.id)
+            else:
+                retries.setdefault(entry.attempts, []).append(entry.id)
+
+        if done:
+            PushOutbox.objects.filter(id__in=done).update(
+                status=PushOutbox.STATUS_SENT, sent_at=now, last_error=''
+            )
+        if dead:
+            PushOutbox.objects.filter(id__in=dead).update(
+                status=PushOutbox.STATUS_DEAD, last_error='Push delivery failed'
+            )
+            logger.error(f"Dead-lettered {len(dead)} push notifications after {self.max_attempts} attempts")
+        for attempts, retry_ids in retries.items():
+            PushOutbox.objects.filter(id__in=retry_ids).update(
+                next_attempt_at=now + self.retry_delay(attempts), last_error='Push delivery failed'
+            )
+
+        return len(entries)
     
     def send_push_notification(self, notification: 'Notification'):
         """Send push notification to user's devices"""
-        if not self.fcm_server_key:
-            logger.warning("FCM_SERVER_KEY not configured")
-            return
-        
-        devices = NotificationDevice.objects.filter(
-            user=notification.recipient,
-            is_active=True
-        )
-        
-        if not devices.exists():
-            return
-        
-        payload = {
+        self.send_push_batch([notification])
+
+    def build_push_payload(self, notification: 'Notification', badge: int = None) -> Dict:
+        if badge is None:
+            badge = self.get_unread_count(notification.recipient_id)
+        return {
             "notification": {
                 "title": notification.title,
                 "body": notification.message,
                 "sound": "default",
-                "badge": self.get_unread_count(notification.recipient)
+                "badge": badge
             },
+            # Chat pushes replace each other on the device instead of stacking
+            **({"collapse_key": f"chat_{notification.chat_room_id}"} if notification.chat_room_id else {}),
             "data": {
                 "notification_id": str(notification.id),
                 "type": notification.notification_type,
                 **notification.data
             }
         }
-        
-        success_count = 0
-        for device in devices:
-            try:
-                payload["to"] = device.device_token
-                
-                headers = {
-                    "Authorization": f"key={self.fcm_server_key}",
-                    "Content-Type": "application/json"
-                }
-                
-                response = requests.post(
-                    self.fcm_url,
-                    data=json.dumps(payload),
-                    headers=headers,
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get('success', 0) > 0:
-                        success_count += 1
-                    else:
-                        # Token might be invalid, deactivate it
-                        if result.get('failure', 0) > 0:
-                            device.is_active = False
-                            device.save()
-                
-            except Exception as e:
-                logger.error(f"Failed to send notification to device {device.id}: {e}")
-        
-        if success_count > 0:
-            notification.is_sent = True
-            notification.save(update_fields=['is_sent'])
+
+    def send_push_batch(self, notifications: List['Notification']) -> Dict:
+        """
+        Push many notifications at once: one query for all recipients'
+        devices, concurrent delivery through the pooled dispatcher, then one
+        UPDATE for dead tokens and one for the notifications that went out.
+
+        Returns {notification_id: outcome}. 'sent' means at least one device
+        received it, 'failed' that every attempt failed transiently and it is
+        worth retrying; notifications with no active devices are left out.
+        """
+        if not self.fcm_server_key:
+            logger.warning("FCM_SERVER_KEY not configured")
+            return {notification.id: 'failed' for notification in notifications}
+
+        devices_by_user = {}
+        devices = NotificationDevice.objects.filter(
+            user_id__in={notification.recipient_id for notification in notifications},
+            is_active=True
+        ).values_list('id', 'user_id', 'device_token')
+        for device_id, user_id, token in devices:
+            devices_by_user.setdefault(user_id, []).append((device_id, token))
+
+        badges = NotificationCounter.counts_for(list(devices_by_user))
+        messages = []
+        for notification in notifications:
+            user_devices = devices_by_user.get(notification.recipient_id)
+            if not user_devices:
+                continue
+            payload = self.build_push_payload(notification, badges[notification.recipient_id])
+            for device_id, token in user_devices:
+                messages.append(((notification.id, device_id), token, payload))
+
+        if not messages:
+            return {}
+
+        result = get_dispatcher().dispatch(messages)
+
+        if result.dead:
+            # Token is no longer registered, deactivate it
+            NotificationDevice.objects.filter(
+                id__in={device_id for _notification_id, device_id in result.dead}
+            ).update(is_active=False)
+        if result.sent:
+            Notification.objects.filter(
+                id__in={notification_id for notification_id, _device_id in result.sent}
+            ).update(is_sent=True)
+        if result.failed:
+            logger.error(f"Failed to deliver {len(result.failed)} push messages")
+
+        outcomes = {notification_id: 'failed' for notification_id, _device_id in result.failed}
+        outcomes.update({notification_id: 'sent' for notification_id, _device_id in result.sent})
+        return outcomes
     
-    def get_unread_count(self, user: User) -> int:
-        """Get unread notification count for badge"""
-        return Notification.objects.filter(recipient=user, is_read=False).count()
+    def get_unread_count(self, user) -> int:
+        """Get unread notification count for badge (a user or a user id)"""
+        user_id = getattr(user, 'pk', user)
+        return NotificationCounter.counts_for([user_id])[user_id]
     
     # Specific notification methods
     
@@ -119,20 +288,19 @@ class NotificationService:
         if exclude_user:
             users = users.exclude(id=exclude_user.id)
         
-        for user in users:
-            self.create_notification(
-                recipient=user,
-                sender=marketplace_item.seller,
-                notification_type='marketplace',
-                title='New Item for Sale!',
-                message=f'{marketplace_item.seller.username} posted "{marketplace_item.title}" for ${marketplace_item.price}',
-                data={
-                    'item_id': marketplace_item.id,
-                    'category': marketplace_item.category,
-                    'price': str(marketplace_item.price)
-                },
-                marketplace_item=marketplace_item
-            )
+        return self.bulk_notify(
+            users.order_by('id').values_list('id', flat=True).iterator(chunk_size=self.fanout_batch_size),
+            sender=marketplace_item.seller,
+            notification_type='marketplace',
+            title='New Item for Sale!',
+            message=f'{marketplace_item.seller.username} posted "{marketplace_item.title}" for ${marketplace_item.price}',
+            data={
+                'item_id': marketplace_item.id,
+                'category': marketplace_item.category,
+                'price': str(marketplace_item.price)
+            },
+            marketplace_item=marketplace_item
+        )
     
     def notify_new_lost_found_item(self, lost_found_item, exclude_user: User = None):
         """Notify all users about new lost & found item"""
@@ -142,20 +310,19 @@ class NotificationService:
         
         status_text = "Lost" if lost_found_item.status == 'lost' else "Found"
         
-        for user in users:
-            self.create_notification(
-                recipient=user,
-                sender=lost_found_item.owner,
-                notification_type='lost_found',
-                title=f'Item {status_text}!',
-                message=f'{lost_found_item.owner.username} reported: "{lost_found_item.title}" - {status_text} at {lost_found_item.location}',
-                data={
-                    'item_id': lost_found_item.id,
-                    'status': lost_found_item.status,
-                    'location': lost_found_item.location
-                },
-                lost_found_item=lost_found_item
-            )
+        return self.bulk_notify(
+            users.order_by('id').values_list('id', flat=True).iterator(chunk_size=self.fanout_batch_size),
+            sender=lost_found_item.owner,
+            notification_type='lost_found',
+            title=f'Item {status_text}!',
+            message=f'{lost_found_item.owner.username} reported: "{lost_found_item.title}" - {status_text} at {lost_found_item.location}',
+            data={
+                'item_id': lost_found_item.id,
+                'status': lost_found_item.status,
+                'location': lost_found_item.location
+            },
+            lost_found_item=lost_found_item
+        )
     
     def notify_connection_request(self, connection_request):
         """Notify user about incoming connection request"""
@@ -188,24 +355,86 @@ class NotificationService:
         )
     
     def notify_new_message(self, message, recipient: User):
-        """Notify user about new chat message"""
+        """
+        Notify user about new chat message.
+
+        Messages collapse per conversation: while the recipient has an unread
+        notification for the room it is updated in place with the latest
+        preview and a message count, so a burst costs one row and one badge
+        increment. Pushes for the room go out at most once per
+        PUSH_COLLAPSE_INTERVAL; messages inside the window are covered by a
+        single trailing push carrying the latest state.
+        """
         # Don't notify if the message is from the same user
         if message.sender == recipient:
             return
         
         # Check if user is currently in the chat (you might want to track this)
         # For now, we'll always send notification
-        
-        self.create_notification(
-            recipient=recipient,
-            sender=message.sender,
-            notification_type='new_message',
-            title=f'New message from {message.sender.username}',
-            # message=message.content[:100] + ('...' if len(message.content) > 100 else ''),
-            data={
-                'message_id': str(message.id),
-                'chat_room_id': str(message.chat_room.id),
-                'sender_id': message.sender.id
-            },
-            message=message
-        )
\ No newline at end of file
+
+        data = {
+            'message_id': str(message.id),
+            'chat_room_id': str(message.chat_room_id),
+            'sender_id': message.sender_id
+        }
+
+        for _attempt in range(2):
+            with transaction.atomic():
+                notification = Notification.objects.select_for_update().filter(
+                    recipient=recipient,
+                    chat_room_id=message.chat_room_id,
+                    notification_type='new_message',
+                    is_read=False
+                ).first()
+                if notification is not None:
+                    return self.collapse_message_notification(notification, message, data)
+
+            try:
+                with transaction.atomic():
+                    notification = self.create_notification(
+                        recipient=recipient,
+                        sender=message.sender,
+                        notification_type='new_message',
+                        title=f'New message from {message.sender.username}',
+                        message=message.preview,
+                        data=data,
+                        chat_message=message,
+                        chat_room_id=message.chat_room_id
+                    )
+            except IntegrityError:
+                # Another message in this room created the notification first
+                continue
+            return notification
+
+    def collapse_message_notification(self, notification: 'Notification', message, data: Dict) -> 'Notification':
+        """
+        Fold another chat message into an existing unread notification.
+
+        The caller holds the row lock, so the push window is read from the
+        outbox rather than a per-process cache. `chat_message` stays on the
+        message that opened the notification; the latest one is in `data`.
+        """
+        notification.message_count += 1
+        notification.sender = message.sender
+        notification.title = f'{notification.message_count} new messages from {message.sender.username}'
+        notification.message = message.preview
+        notification.data = data
+        notification.last_message_at = timezone.now()
+        notification.is_sent = False
+        notification.save(update_fields=[
+            'message_count', 'sender', 'title', 'message', 'data', 'last_message_at', 'is_sent'
+        ])
+
+        # A push is waiting or went out within the interval. next_attempt_at
+        # can't tell: claiming a row moves it a lease ahead, and it stays there
+        window_start = notification.last_message_at - timedelta(seconds=self.collapse_interval)
+        recent_push = notification.push_outbox.filter(
+            Q(status=PushOutbox.STATUS_PENDING)
+            | Q(status=PushOutbox.STATUS_SENT, sent_at__gt=window_start)
+        )
+        if not recent_push.exists():
+            self.enqueue_push([notification.id])
+        else:
+            # Inside the window: one trailing push picks up whatever is latest by then
+            self.enqueue_push([notification.id], delay=self.collapse_interval)
+        return notification
\ No newline at end of file
@@ -1,21 +1,24 @@
 
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from .models import Notification, NotificationCounter
 from .services import NotificationService
+from .tasks import fan_out_marketplace_item, fan_out_lost_found_item
 
 notification_service = NotificationService()
 
 @receiver(post_save, sender='campus_connect.MarketplaceItem')
 def marketplace_item_created(sender, instance, created, **kwargs):
-    """Send notification when new marketplace item is created"""
+    """Queue the campus-wide fan-out for a new marketplace item"""
     if created:
-        notification_service.notify_new_marketplace_item(instance)
+        transaction.on_commit(lambda: fan_out_marketplace_item.delay(instance.pk))
 
 @receiver(post_save, sender='campus_connect.LostAndFoundItem')  
 def lost_found_item_created(sender, instance, created, **kwargs):
-    """Send notification when new lost & found item is created"""
+    """Queue the campus-wide fan-out for a new lost & found item"""
     if created:
-        notification_service.notify_new_lost_found_item(instance)
+        transaction.on_commit(lambda: fan_out_lost_found_item.delay(instance.pk))
 
 @receiver(post_save, sender='campus_connect.ConnectionRequest')
 def connection_request_created(sender, instance, created, **kwargs):
@@ -32,3 +35,9 @@ def message_created(sender, instance, created, **kwargs):
         # Get the recipient (other user in chat room)
         recipient = instance.chat_room.get_other_user(instance.sender)
         notification_service.notify_new_message(instance, recipient)
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    """Keep the badge counter in step when an unread notification goes away"""
+    if not instance.is_read:
+        NotificationCounter.decrement(instance.recipient_id)
@@ -0,0 +1,47 @@
+from celery import shared_task
+from django.core.management import call_command
+from campus_connect.models import MarketplaceItem, LostAndFoundItem
+from .services import NotificationService
+
+
+@shared_task
+def fan_out_marketplace_item(item_id):
+    """Notify every other user about a new marketplace listing"""
+    item = MarketplaceItem.objects.select_related('seller').filter(pk=item_id).first()
+    if item is None:
+        return 0
+    return NotificationService().notify_new_marketplace_item(item)
+
+
+@shared_task
+def fan_out_lost_found_item(item_id):
+    """Notify every other user about a new lost & found report"""
+    item = LostAndFoundItem.objects.select_related('owner').filter(pk=item_id).first()
+    if item is None:
+        return 0
+    return NotificationService().notify_new_lost_found_item(item)
+
+
+@shared_task
+def drain_push_outbox(max_batches=20):
+    """
+    Deliver due pushes from the outbox, a batch at a time.
+
+    Scheduled periodically by celery beat and, with a broker, also kicked
+    after each commit that adds outbox rows; concurrent runs are safe as
+    each claims its own rows.
+    """
+    service = NotificationService()
+    drained = 0
+    for _ in range(max_batches):
+        claimed = service.drain_outbox_batch()
+        drained += claimed
+        if claimed < service.outbox_batch_size:
+            break
+    return drained
+
+
+@shared_task
+def reconcile_notification_counters():
+    """Correct any drift in the unread badge counters"""
+    call_command('reconcile_notification_counters')
@@ -1,3 +1,327 @@
-from django.test import TestCase
+import datetime
+from datetime import timedelta
+import json
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from campus_connect.models import User, MarketplaceItem, LostAndFoundItem, ChatRoom
+from .models import Notification, NotificationCounter, PushOutbox
+from .push import PushDispatcher
+from .services import NotificationService
+from .tasks import fan_out_lost_found_item, fan_out_marketplace_item
+
+
+class NotificationTestCase(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', password='pass')
+        self.others = [User.objects.create_user(f'student{i}', password='pass') for i in range(3)]
+
+
+
+class NotificationApiTestCase(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.reader = self.others[0]
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def notify(self, title='Hi', **kwargs):
+        return NotificationService().create_notification(
+            recipient=self.reader, notification_type='system', title=title, message='Hello', **kwargs
+        )
+
+    def badge(self):
+        return self.client.get('/api/notifications/unread-count/').data['unread_count']
+
+
+class NotificationCounterTests(NotificationApiTestCase):
+    def test_badge_follows_creates_and_reads(self):
+        first, _second, _third = [self.notify(f'N{i}') for i in range(3)]
+        self.assertEqual(self.badge(), 3)
+
+        self.client.post(f'/api/notifications/{first.id}/read/')
+        self.client.post(f'/api/notifications/{first.id}/read/')
+        self.assertEqual(self.badge(), 2)
+
+        self.client.post('/api/notifications/mark-all-read/')
+        self.assertEqual(self.badge(), 0)
+
+    def test_deleting_an_unread_notification_drops_the_badge(self):
+        self.notify().delete()
+        self.assertEqual(self.badge(), 0)
+
+    def test_badge_read_is_one_query(self):
+        self.notify()
+        with self.assertNumQueries(1):
+            self.assertEqual(NotificationService().get_unread_count(self.reader), 1)
+
+    def test_reconcile_repairs_drifted_counts(self):
+        self.notify()
+        NotificationCounter.objects.filter(user=self.reader).update(unread_count=9)
+
+        call_command('reconcile_notification_counters', stdout=StringIO())
+
+        self.assertEqual(self.badge(), 1)
+        self.assertEqual(NotificationCounter.counts_for([self.seller.id]), {self.seller.id: 0})
+
+
+
+class NotificationListTests(NotificationApiTestCase):
+    def listing(self, url='/api/notifications/?page_size=20'):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_cursor_walks_newest_first(self):
+        notifications = [self.notify(f'N{i}') for i in range(5)]
+
+        seen = []
+        url = '/api/notifications/?page_size=2'
+        while url:
+            page, _queries = self.listing(url)
+            seen += [item['title'] for item in page['results']]
+            url = page['next']
+
+        self.assertEqual(seen, [notification.title for notification in reversed(notifications)])
+
+    def test_unread_filter(self):
+        read, unread = self.notify('Read'), self.notify('Unread')
+        read.mark_as_read()
+
+        page, _queries = self.listing('/api/notifications/?unread=true&page_size=20')
+
+        self.assertEqual([item['id'] for item in page['results']], [str(unread.id)])
+
+    def test_related_objects_do_not_add_queries_per_row(self):
+        def notify_about_item(i):
+            item = MarketplaceItem.objects.create(
+                seller=self.seller, title=f'Item {i}', description='Desc', price=5, category='Others'
+            )
+            self.notify(f'N{i}', sender=self.seller, marketplace_item=item)
+
+        notify_about_item(0)
+        _page, one_row = self.listing()
+
+        for i in range(1, 5):
+            notify_about_item(i)
+        page, five_rows = self.listing()
+
+        self.assertEqual(len(page['results']), 5)
+        self.assertEqual(page['results'][0]['marketplace_item_title'], 'Item 4')
+        self.assertEqual(page['results'][0]['sender'], str(self.seller))
+        self.assertEqual(five_rows, one_row)
+
+
+
+@override_settings(PUSH_COLLAPSE_INTERVAL=30)
+class ChatNotificationCollapseTests(NotificationApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.room = ChatRoom.objects.create(user1=self.reader, user2=self.seller)
+
+    def chat_notification(self):
+        return Notification.objects.get(recipient=self.reader, chat_room=self.room)
+
+    def test_burst_folds_into_one_notification(self):
+        first = self.room.add_message(self.seller, content='One')
+        opened_at = self.chat_notification().created_at
+        self.room.add_message(self.seller, content='Two')
+        latest = self.room.add_message(self.seller, content='Three')
+
+        notification = self.chat_notification()
+        self.assertEqual(notification.message_count, 3)
+        self.assertEqual(notification.message, 'Three')
+        self.assertEqual(notification.data['message_id'], str(latest.id))
+        self.assertEqual(notification.chat_message_id, first.id)
+        self.assertEqual(notification.created_at, opened_at)
+        self.assertGreater(notification.last_message_at, opened_at)
+        self.assertEqual(self.badge(), 1)
+
+    @override_settings(FCM_SERVER_KEY='key')
+    def drain_as_sent(self, notification):
+        service = NotificationService()
+        with mock.patch.object(service, 'send_push_batch', return_value={notification.id: 'sent'}):
+            self.assertEqual(service.drain_outbox_batch(), 1)
+
+    def test_pushes_inside_the_window_collapse_into_one_trailing_push(self):
+        self.room.add_message(self.seller, content='One')
+        notification = self.chat_notification()
+        self.drain_as_sent(notification)
+
+        before = timezone.now()
+        self.room.add_message(self.seller, content='Two')
+        self.room.add_message(self.seller, content='Three')
+
+        pending = PushOutbox.objects.get(notification=notification, status=PushOutbox.STATUS_PENDING)
+        self.assertGreaterEqual(pending.next_attempt_at, before + timedelta(seconds=30))
+
+    def test_push_is_immediate_once_the_window_has_passed(self):
+        self.room.add_message(self.seller, content='One')
+        notification = self.chat_notification()
+        self.drain_as_sent(notification)
+
+        later = timezone.now() + timedelta(seconds=45)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.room.add_message(self.seller, content='Two')
+
+        pending = PushOutbox.objects.get(notification=notification, status=PushOutbox.STATUS_PENDING)
+        self.assertEqual(pending.next_attempt_at, later)
+
+    def test_deleting_the_latest_message_keeps_the_notification(self):
+        self.room.add_message(self.seller, content='One')
+        latest = self.room.add_message(self.seller, content='Two')
+
+        latest.delete()
+
+        self.assertEqual(self.chat_notification().message_count, 2)
+        self.assertEqual(self.badge(), 1)
+
+
+@override_settings(NOTIFICATION_FANOUT_BATCH_SIZE=2)
+class FanOutTests(NotificationTestCase):
+    def test_new_listing_notifies_everyone_else_in_batches(self):
+        item = MarketplaceItem.objects.create(
+            seller=self.seller, title='Desk lamp', description='Barely used lamp',
+            price=12, category='Others'
+        )
+
+        self.assertEqual(fan_out_marketplace_item(item.pk), 3)
+
+        notifications = Notification.objects.filter(marketplace_item=item)
+        self.assertEqual(
+            sorted(notifications.values_list('recipient_id', flat=True)),
+            [user.id for user in self.others]
+        )
+        self.assertEqual(PushOutbox.objects.filter(notification__in=notifications).count(), 3)
+        counts = NotificationCounter.counts_for([user.id for user in self.others] + [self.seller.id])
+        self.assertEqual(counts, {**{user.id: 1 for user in self.others}, self.seller.id: 0})
+
+    def test_fan_out_waits_for_the_commit(self):
+        with self.captureOnCommitCallbacks():
+            item = LostAndFoundItem.objects.create(
+                owner=self.seller, title='Keys', description='Blue keyring', status='found',
+                location='Library', date=datetime.date.today()
+            )
+        self.assertFalse(Notification.objects.exists())
+
+        fan_out_lost_found_item(item.pk)
+        self.assertEqual(Notification.objects.filter(notification_type='lost_found').count(), 3)
+
+
+def fcm_response(status_code=200, body=None, text=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = (text if text is not None else json.dumps(body)).encode()
+    return response
+
+
+class PushDispatcherTests(TestCase):
+    def setUp(self):
+        self.dispatcher = PushDispatcher(server_key='key', url='https://fcm.test/send', max_concurrency=4)
+        self.addCleanup(self.dispatcher.executor.shutdown)
+
+    def dispatch(self, responses):
+        def post(url, data, timeout):
+            outcome = responses[json.loads(data)['to']]
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        with mock.patch.object(self.dispatcher.session, 'post', side_effect=post):
+            return self.dispatcher.dispatch([(token, token, {}) for token in responses])
+
+    def test_outcomes_are_grouped_per_token(self):
+        result = self.dispatch({
+            'ok': fcm_response(body={'success': 1}),
+            'gone': fcm_response(body={'failure': 1, 'results': [{'error': 'NotRegistered'}]}),
+            'busy': fcm_response(body={'failure': 1, 'results': [{'error': 'Unavailable'}]}),
+            'down': requests.ConnectionError('refused'),
+        })
+        self.assertEqual((result.sent, result.dead, sorted(result.failed)), (['ok'], ['gone'], ['busy', 'down']))
+
+    def test_non_json_body_fails_only_that_token(self):
+        result = self.dispatch({
+            'ok': fcm_response(body={'success': 1}),
+            'html': fcm_response(text='<html>Bad gateway</html>'),
+            'gone': fcm_response(body={'failure': 1, 'results': [{'error': 'InvalidRegistration'}]}),
+        })
+        self.assertEqual((result.sent, result.dead, result.failed), (['ok'], ['gone'], ['html']))
+
+
+@override_settings(FCM_SERVER_KEY='key', PUSH_MAX_ATTEMPTS=2, PUSH_RETRY_BASE_DELAY=30)
+class PushOutboxTests(NotificationTestCase):
+    def notify(self):
+        return NotificationService().create_notification(
+            recipient=self.others[0], notification_type='system', title='Hi', message='Hello'
+        )
+
+    def drain(self, outcome):
+        service = NotificationService()
+        with mock.patch.object(
+            service, 'send_push_batch',
+            side_effect=lambda notifications: {notification.id: outcome for notification in notifications}
+        ) as send:
+            claimed = service.drain_outbox_batch()
+        return claimed, send
+
+    def test_enqueueing_a_waiting_notification_again_is_a_no_op(self):
+        notification = self.notify()
+        NotificationService().enqueue_push([notification.id])
+        NotificationService().enqueue_push([notification.id], delay=60)
+
+        self.assertEqual(PushOutbox.objects.filter(notification=notification).count(), 1)
+
+    def test_no_drain_runs_inside_the_request_when_tasks_are_eager(self):
+        with self.settings(CELERY_TASK_ALWAYS_EAGER=True), self.captureOnCommitCallbacks() as callbacks:
+            self.notify()
+        self.assertEqual(callbacks, [])
+
+        with self.settings(CELERY_TASK_ALWAYS_EAGER=False), self.captureOnCommitCallbacks() as callbacks:
+            self.notify()
+        self.assertEqual(len(callbacks), 1)
+
+    def test_sent_rows_are_closed(self):
+        notification = self.notify()
+
+        claimed, _send = self.drain('sent')
+
+        self.assertEqual(claimed, 1)
+        entry = PushOutbox.objects.get(notification=notification)
+        self.assertEqual(entry.status, PushOutbox.STATUS_SENT)
+
+    def test_failures_back_off_then_dead_letter(self):
+        notification = self.notify()
+
+        before = timezone.now()
+        self.drain('failed')
+        entry = PushOutbox.objects.get(notification=notification)
+        self.assertEqual((entry.status, entry.attempts), (PushOutbox.STATUS_PENDING, 1))
+        self.assertGreaterEqual(entry.next_attempt_at, before + timedelta(seconds=30))
+
+        # Not due yet, so the next drain leaves it alone
+        claimed, send = self.drain('failed')
+        self.assertEqual(claimed, 0)
+
+        PushOutbox.objects.filter(pk=entry.pk).update(next_attempt_at=timezone.now())
+        self.drain('failed')
+        entry.refresh_from_db()
+        self.assertEqual((entry.status, entry.attempts), (PushOutbox.STATUS_DEAD, 2))
+
+    def test_already_sent_notifications_are_not_pushed_again(self):
+        notification = self.notify()
+        Notification.objects.filter(pk=notification.pk).update(is_sent=True)
+
+        claimed, send = self.drain('sent')
+
+        self.assertEqual(claimed, 1)
+        send.assert_not_called()
+        self.assertEqual(PushOutbox.objects.get(notification=notification).status, PushOutbox.STATUS_SENT)
@@ -4,18 +4,31 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from .models import Notification, NotificationDevice
+from django.db import transaction
+from .models import Notification, NotificationCounter, NotificationDevice
 from django.utils import timezone
+from campus_connect.pagination import KeysetPagination
 from .serializers import NotificationSerializer
 
 
 class NotificationListView(generics.ListAPIView):
-    """Get user's notifications"""
+    """
+    Get user's notifications, newest first.
+
+    Pass `cursor`/`page_size` for keyset pages over the (recipient,
+    -created_at) index and `unread=true` to only list unread ones.
+    """
     permission_classes = [IsAuthenticated]
     serializer_class = NotificationSerializer
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
-        return Notification.objects.filter(recipient=self.request.user)
+        queryset = Notification.objects.filter(
+            recipient=self.request.user
+        ).select_related('recipient', 'sender', 'marketplace_item', 'lost_found_item')
+        if self.request.query_params.get('unread', '').lower() in ('1', 'true', 'yes'):
+            queryset = queryset.filter(is_read=False)
+        return queryset
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -57,10 +70,14 @@ def mark_notification_read(request, notification_id):
 @permission_classes([IsAuthenticated])
 def mark_all_notifications_read(request):
     """Mark all notifications as read"""
-    Notification.objects.filter(
-        recipient=request.user, 
-        is_read=False
-    ).update(is_read=True, read_at=timezone.now())
+    with transaction.atomic():
+        updated = Notification.objects.filter(
+            recipient=request.user, 
+            is_read=False
+        ).update(is_read=True, read_at=timezone.now())
+        # Subtract what was actually flipped, so a notification created
+        # concurrently still counts as unread
+        NotificationCounter.decrement(request.user.id, updated)
     
     return Response({'message': 'All notifications marked as read'})
 
@@ -68,10 +85,7 @@ def mark_all_notifications_read(request):
 @permission_classes([IsAuthenticated])
 def unread_count(request):
     """Get unread notification count"""
-    count = Notification.objects.filter(
-        recipient=request.user, 
-        is_read=False
-    ).count()
+    count = NotificationCounter.counts_for([request.user.id])[request.user.id]
     
     return Response({'unread_count': count})
 